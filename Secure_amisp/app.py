@@ -2,21 +2,33 @@
 from flask import Flask, request, jsonify, render_template, abort
 from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
+import atexit
 import hashlib
 import os
+import sys
 
 # Import modules from your project
-from database import get_db, Consumer, Meter, MeterReading, Payment, VendorApiKey, VendorAuditLog, MeterCommand
+from database import get_db, Consumer, Meter, Payment, VendorApiKey, VendorAuditLog, MeterCommand
 from models import (
     InstallMeterRequest, RemoveMeterRequest, UploadReadingRequest, RechargeRequest, CommandRequest, 
     ApiStatusResponse, CommandStatusResponse # Pydantic models for validation and response
 )
 
+# Shared with the utility API: the write-behind reading buffer and the DB layer at the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database_manager import VENDOR_KEY_CACHE, DatabaseManager
+from ingest_buffer import IngestBacklogFull, ReadingBuffer
+
 # --- Configuration & Initialization ---
 app = Flask(__name__)
 
+# Readings are acknowledged once spooled and written to meter_readings in large batches
+READING_BUFFER = ReadingBuffer("amisp", DatabaseManager().insert_meter_readings)
+atexit.register(READING_BUFFER.close)
+
 # --- Pydantic Validation Helper ---
 def validate_payload(model):
     """Decorator to validate the request JSON payload against a Pydantic model."""
@@ -47,23 +59,26 @@ def get_current_vendor_id(func):
         if not vendor_id_header:
             abort(401, description="Missing X-Vendor-ID header")
         
-        # Use database session to verify the Vendor ID
+        # The session only checks out a connection on its first query
         with next(get_db()) as db:
-            # 1. Look up the Vendor based on the ID provided in the header
-            stmt = select(VendorApiKey).where(
-                # We check the vendor_id directly (no hashing needed here)
-                VendorApiKey.vendor_id == vendor_id_header,
-                VendorApiKey.is_active == True
-            )
-            vendor_key_record = db.execute(stmt).scalars().first()
+            # 1. Resolve the Vendor ID through the shared credential cache; the SELECT runs only on a miss
+            def load_vendor(key):
+                stmt = select(VendorApiKey.vendor_id).where(
+                    # We check the vendor_id directly (no hashing needed here)
+                    VendorApiKey.vendor_id == key[1],
+                    VendorApiKey.is_active == True
+                )
+                return db.execute(stmt).scalars().first()
+
+            verified_vendor_id = VENDOR_KEY_CACHE.get(("vendor_id", vendor_id_header), load_vendor)
             
-            if not vendor_key_record:
+            if not verified_vendor_id:
                 # Log attempt with invalid Vendor ID
                 log_audit(db, vendor_id_header, request.path, request.get_json(silent=True), 401)
                 abort(401, description=f"Invalid or inactive Vendor ID '{vendor_id_header}'.")
             
             # The Vendor ID is now verified and safe to use
-            kwargs['vendor_id'] = vendor_key_record.vendor_id # Pass verified vendor_id to the route
+            kwargs['vendor_id'] = verified_vendor_id # Pass verified vendor_id to the route
             kwargs['db'] = db # Pass active session to the route
             
             # Execute the actual endpoint logic
@@ -144,66 +159,98 @@ def install_meter(db: Session, vendor_id: str, payload: InstallMeterRequest):
 @get_current_vendor_id
 @validate_payload(UploadReadingRequest)
 def upload_reading(db: Session, vendor_id: str, payload: UploadReadingRequest):
-    """Inserts a new meter reading."""
+    """Queues a new meter reading (write-behind: spooled now, inserted by the buffer's flusher)."""
     
     meter = db.get(Meter, payload.meter_id)
     if not meter or meter.status != 'INSTALLED':
         abort(404, description="Meter not found or not installed.")
 
-    new_reading = MeterReading(
-        meter_id=payload.meter_id,
-        reading_datetime=payload.reading_datetime,
-        kwh=payload.kwh
-    )
-    
     try:
-        db.add(new_reading)
-        db.commit()
-        return jsonify(ApiStatusResponse(
-            status="success", 
-            message=f"Reading {payload.kwh} kWh accepted for processing."
-        ).model_dump()), 202
+        READING_BUFFER.enqueue([(payload.meter_id, payload.reading_datetime, payload.kwh)])
+    except IngestBacklogFull as e:
+        abort(503, description=f"Reading ingestion is backlogged, retry later: {e}")
     except Exception as e:
-        db.rollback()
-        abort(500, description=f"DB Error: Reading upload failed. {e}")
+        abort(500, description=f"Spool Error: Reading upload failed. {e}")
+
+    return jsonify(ApiStatusResponse(
+        status="success", 
+        message=f"Reading {payload.kwh} kWh accepted for processing."
+    ).model_dump()), 202
 
 
 @app.route("/api/recharge", methods=['POST'])
 @get_current_vendor_id
 @validate_payload(RechargeRequest)
 def process_recharge(db: Session, vendor_id: str, payload: RechargeRequest):
-    """Processes a payment, records it, and updates consumer balance."""
+    """Processes a payment, records it, and updates consumer balance (idempotent per transaction_ref)."""
     
-    consumer = db.get(Consumer, payload.consumer_id)
-    if not consumer:
-        abort(404, description="Consumer not found.")
-
-    # 1. Record the Payment
-    new_payment = Payment(
-        consumer_id=payload.consumer_id,
-        amount=payload.amount,
-        transaction_ref=payload.transaction_ref
-    )
+    replay = recharge_replay(db, payload)
+    if replay:
+        return replay
 
-    # 2. Update Consumer Balance
-    consumer.balance += payload.amount
-    
     try:
-        db.add(new_payment)
-        db.commit()
-        return jsonify(ApiStatusResponse(
-            status="success", 
-            message=f"Recharge of {payload.amount} processed.",
-            data={"new_balance": consumer.balance}
-        ).model_dump()), 200
+        # 1. Record the Payment first: the unique transaction_ref serializes retries
+        #    of one payment before the consumer row is locked
+        db.add(Payment(
+            consumer_id=payload.consumer_id,
+            amount=payload.amount,
+            transaction_ref=payload.transaction_ref
+        ))
+        db.flush()
+
+        # 2. Credit the balance in place; no read-modify-write, so concurrent recharges cannot lose updates
+        db.execute(
+            update(Consumer)
+            .where(Consumer.consumer_id == payload.consumer_id)
+            .values(balance=Consumer.balance + payload.amount)
+        )
+        # The row count cannot tell a missing consumer from an unchanged balance; the read-back can
+        new_balance = db.execute(
+            select(Consumer.balance).where(Consumer.consumer_id == payload.consumer_id)
+        ).scalar()
+        if new_balance is None:
+            db.rollback()
+        else:
+            db.commit()
+    except IntegrityError:
+        # A concurrent retry of the same payment committed first
+        db.rollback()
+        replay = recharge_replay(db, payload)
+        if replay:
+            return replay
+        abort(409, description="Transaction reference already exists.")
     except Exception as e:
         db.rollback()
-        # Simple check for unique constraint violation (transaction_ref)
-        if "unique constraint" in str(e).lower():
-            abort(409, description="Transaction reference already exists.")
-            
         abort(500, description=f"DB Error: Recharge failed. {e}")
 
+    if new_balance is None:
+        abort(404, description="Consumer not found.")
+    return jsonify(ApiStatusResponse(
+        status="success", 
+        message=f"Recharge of {payload.amount} processed.",
+        data={"new_balance": new_balance, "replayed": False}
+    ).model_dump()), 200
+
+
+def recharge_replay(db: Session, payload: RechargeRequest):
+    """
+    Response for a transaction_ref already in payments: the same recharge is answered
+    from the ledger without writing; a different consumer or amount is a 409.
+    """
+    payment = db.execute(
+        select(Payment).where(Payment.transaction_ref == payload.transaction_ref)
+    ).scalars().first()
+    if payment is None:
+        return None
+    if payment.consumer_id != payload.consumer_id or abs(payment.amount - payload.amount) > 1e-6:
+        abort(409, description="Transaction reference already used for a different recharge.")
+    balance = db.execute(select(Consumer.balance).where(Consumer.consumer_id == payment.consumer_id)).scalar()
+    return jsonify(ApiStatusResponse(
+        status="success",
+        message=f"Recharge {payload.transaction_ref} already processed.",
+        data={"new_balance": balance, "replayed": True}
+    ).model_dump()), 200
+
 
 @app.route("/api/meter-command", methods=['POST'])
 @get_current_vendor_id
@@ -260,6 +307,7 @@ def get_command_status(db: Session, vendor_id: str, command_id: int):
 @app.errorhandler(400)
 @app.errorhandler(409)
 @app.errorhandler(500)
+@app.errorhandler(503)
 def handle_http_exception(e):
     # This block is essential for logging failures that happen BEFORE the main route logic
     # It catches exceptions raised by abort()
@@ -274,6 +322,8 @@ def handle_http_exception(e):
     # Return a JSON response for the API clients
     response = jsonify({'status': 'error', 'message': e.description, 'code': e.code})
     response.status_code = e.code
+    if e.code == 503:
+        response.headers['Retry-After'] = '5'
     return response
 
 # --------------------------------------------------
@@ -118,8 +118,12 @@ class MeterCommand(Base):
 
 
 # --- Table Creation Logic ---
+# The schema (tables and indexes) is owned by the repo-level migrations.py, shared
+# with the billing DatabaseManager; these models only map onto it.
 if __name__ == "__main__":
-    print("Attempting to create/verify MySQL database tables...")
-    # NOTE: Be sure your database ('defaultdb' or whatever you're using) exists first.
-    Base.metadata.create_all(bind=engine, checkfirst=True)
-    print("Database table creation/verification complete.")
\ No newline at end of file
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import migrations
+
+    print("Applying schema migrations to the MySQL database...")
+    migrations.upgrade()
@@ -0,0 +1,329 @@
+# async_database_manager.py - Non-blocking MySQL access for the FastAPI router
+import asyncio
+import ssl
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
+import aiomysql
+from database_manager import (
+    BULK_INSERT_CHUNK_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_SIZE, DB_POOL_TIMEOUT, DUPLICATE_KEY_ERRNO, RECHARGE_REPLAY_QUERY,
+    DatabaseManager, PoolTimeout, RechargeResult, TARIFF_CACHE, UnknownConsumer, VENDOR_KEY_CACHE, hash_api_key, parse_db_url,
+    recharge_replay,
+)
+from prepaid_module_v2 import Consumer
+from query_metrics import QUERY_METRICS, calling_method
+
+DB_POOL_RECYCLE = 3600  # Seconds before an idle connection is reopened
+
+MeterCommand = namedtuple("MeterCommand", "command_id meter_id command_type status response_message")
+
+
+# -----------------------------
+# Shared Async Connection Pool
+# -----------------------------
+_ASYNC_POOL = None
+_ASYNC_POOL_LOCK = None
+
+
+def _ssl_context(ssl_mode):
+    """Map the DB URL's ssl-mode onto an SSLContext (REQUIRED encrypts without verifying, like the sync driver)."""
+    if ssl_mode.upper() == "DISABLED":
+        return None
+    context = ssl.create_default_context()
+    if ssl_mode.upper() in ("REQUIRED", "PREFERRED"):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def get_async_pool():
+    """Return the event loop's aiomysql pool, creating it on first use."""
+    global _ASYNC_POOL, _ASYNC_POOL_LOCK
+    if _ASYNC_POOL is None:
+        if _ASYNC_POOL_LOCK is None:
+            _ASYNC_POOL_LOCK = asyncio.Lock()
+        async with _ASYNC_POOL_LOCK:
+            if _ASYNC_POOL is None:
+                db_config = parse_db_url()
+                print(f"🌐 Connecting (async) to MySQL @ {db_config['host']}:{db_config['port']} "
+                      f"(DB: {db_config['database']}, pool {DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW})")
+                _ASYNC_POOL = await aiomysql.create_pool(
+                    host=db_config["host"],
+                    port=db_config["port"] or 3306,
+                    user=db_config["user"],
+                    password=db_config["password"],
+                    db=db_config["database"],
+                    ssl=_ssl_context(db_config["ssl_mode"]),
+                    minsize=1,
+                    maxsize=DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    autocommit=True,
+                )
+    return _ASYNC_POOL
+
+
+async def close_async_pool():
+    global _ASYNC_POOL
+    if _ASYNC_POOL is not None:
+        _ASYNC_POOL.close()
+        await _ASYNC_POOL.wait_closed()
+        _ASYNC_POOL = None
+
+
+def async_pool_stats():
+    if _ASYNC_POOL is None:
+        return None
+    return {
+        "size": _ASYNC_POOL.size,
+        "free": _ASYNC_POOL.freesize,
+        "in_use": _ASYNC_POOL.size - _ASYNC_POOL.freesize,
+        "max_size": _ASYNC_POOL.maxsize,
+    }
+
+
+class AsyncDatabaseManager:
+    """
+    asyncio counterpart of DatabaseManager for the API router: same method names
+    and return values, but every query awaits a connection from the shared aiomysql
+    pool instead of blocking a worker thread. Statements are timed into QUERY_METRICS.
+    Batch jobs (invoice generation) still run on the sync manager, in a thread.
+    """
+
+    def __init__(self):
+        self._sync = DatabaseManager()
+
+    @asynccontextmanager
+    async def _connection(self):
+        pool = await get_async_pool()
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No async DB connection free after {DB_POOL_TIMEOUT}s") from None
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Async version of DatabaseManager.transaction(): yields a cursor, commits once, rolls back on error."""
+        async with self._connection() as conn:
+            await conn.begin()
+            cursor = await conn.cursor()
+            try:
+                yield cursor
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+            finally:
+                await cursor.close()
+
+    async def _execute(self, cursor, query, params=()):
+        caller = calling_method()
+        start = time.perf_counter()
+        error = False
+        try:
+            return await cursor.execute(query, params)
+        except Exception:
+            error = True
+            raise
+        finally:
+            QUERY_METRICS.record(query, caller, time.perf_counter() - start, cursor.rowcount, error)
+
+    # -----------------------------
+    # Utility: Run Query Safely
+    # -----------------------------
+    async def _run_query(self, query, params=(), fetch=False, fetchone=False, rowcount=False, lastrowid=False):
+        try:
+            async with self._connection() as conn:
+                async with conn.cursor() as cursor:
+                    await self._execute(cursor, query, params)
+                    if fetchone:
+                        return await cursor.fetchone()
+                    if fetch:
+                        return await cursor.fetchall()
+                    if rowcount:
+                        return cursor.rowcount
+                    if lastrowid:
+                        return cursor.lastrowid
+                    return None
+        except Exception as e:
+            print(f"⚠️ DB Error in {calling_method()}: {e}")
+            return None
+
+    # -----------------------------
+    # Vendors
+    # -----------------------------
+    async def get_vendor_by_api_key(self, api_key):
+        """
+        Active vendor whose stored SHA-256 key hash matches api_key, as {'vendor_id': ...},
+        else None. Answered from VENDOR_KEY_CACHE when possible; a failed lookup is not cached.
+        """
+        key = ("api_key_hash", hash_api_key(api_key))
+        hit, vendor_id = VENDOR_KEY_CACHE.lookup(key)
+        if not hit:
+            try:
+                async with self._connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await self._execute(cursor, "SELECT vendor_id FROM vendor_api_keys "
+                                                    "WHERE api_key_hash = %s AND is_active = 1", (key[1],))
+                        row = await cursor.fetchone()
+            except Exception as e:
+                print(f"⚠️ DB Error (vendor key lookup): {e}")
+                return None
+            vendor_id = VENDOR_KEY_CACHE.store(key, row[0] if row else None)
+        return {"vendor_id": vendor_id} if vendor_id is not None else None
+
+    async def revoke_vendor_api_keys(self, vendor_id):
+        """Deactivate a vendor's API keys and drop it from VENDOR_KEY_CACHE; returns keys revoked."""
+        revoked = await self._run_query(
+            "UPDATE vendor_api_keys SET is_active = 0 WHERE vendor_id = %s AND is_active = 1", (vendor_id,), rowcount=True)
+        VENDOR_KEY_CACHE.invalidate(vendor_id)
+        return revoked
+
+    async def get_active_vendors_count(self):
+        row = await self._run_query("SELECT COUNT(*) FROM vendor_api_keys WHERE is_active = 1", fetchone=True)
+        return row[0] if row else None
+
+    # -----------------------------
+    # Consumers
+    # -----------------------------
+    async def get_consumer_by_id(self, consumer_id):
+        query = "SELECT consumer_id, name, address, phone, balance, status, plan_id FROM consumers WHERE consumer_id = %s"
+        row = await self._run_query(query, (consumer_id,), fetchone=True)
+        if row:
+            consumer = Consumer(
+                consumer_id=row[0],
+                name=row[1],
+                address=row[2],
+                phone=row[3],
+                balance=row[4],
+                plan_id=row[6],
+            )
+            consumer.status = row[5]
+            return consumer
+        return None
+
+    async def get_low_balance_alerts(self):
+        """Consumers whose balance is below their tariff's low_balance_threshold."""
+        rows = await self._run_query("""
+            SELECT c.consumer_id, c.name, c.balance, t.low_balance_threshold
+            FROM consumers c
+            JOIN tariff_plan t ON t.plan_id = c.plan_id
+            WHERE c.balance < t.low_balance_threshold
+        """, fetch=True) or []
+        return [
+            {"consumer_id": row[0], "name": row[1], "balance": row[2], "threshold": row[3]}
+            for row in rows
+        ]
+
+    # -----------------------------
+    # Recharges
+    # -----------------------------
+    async def _find_recharge(self, transaction_ref, consumer_id, amount):
+        if transaction_ref is None:
+            return None
+        row = await self._run_query(RECHARGE_REPLAY_QUERY, (transaction_ref,), fetchone=True)
+        return recharge_replay(row, consumer_id, amount) if row else None
+
+    async def process_recharge(self, consumer_id, amount, payment_mode, transaction_ref=None):
+        """
+        Same contract as DatabaseManager.process_recharge: ledger insert, then an
+        in-place balance increment, in one transaction; a recorded transaction_ref
+        is replayed without writing. Returns a RechargeResult, or None if the
+        consumer does not exist; raises RechargeConflict on a reused reference
+        and ValueError on a non-positive amount.
+        """
+        if not amount > 0:
+            raise ValueError(f"Recharge amount must be positive, got {amount}")
+        replay = await self._find_recharge(transaction_ref, consumer_id, amount)
+        if replay:
+            return replay
+        try:
+            async with self.transaction() as cursor:
+                await self._execute(cursor, """
+                    INSERT INTO recharges (consumer_id, amount, payment_mode, transaction_ref, created_at)
+                    VALUES (%s, %s, %s, %s, NOW())
+                """, (consumer_id, amount, payment_mode, transaction_ref))
+                await self._execute(cursor, "UPDATE consumers SET balance = balance + %s WHERE consumer_id = %s",
+                                    (amount, consumer_id))
+                # Not rowcount: MySQL counts changed rows, so it cannot tell a missing consumer apart
+                await self._execute(cursor, "SELECT balance FROM consumers WHERE consumer_id = %s", (consumer_id,))
+                row = await cursor.fetchone()
+                if row is None:
+                    raise UnknownConsumer(consumer_id)
+                return RechargeResult(row[0], False)
+        except UnknownConsumer:
+            return None
+        except aiomysql.IntegrityError as e:
+            # A concurrent retry of the same payment committed first
+            if e.args[0] != DUPLICATE_KEY_ERRNO:
+                raise
+            return await self._find_recharge(transaction_ref, consumer_id, amount)
+
+    # -----------------------------
+    # Tariff
+    # -----------------------------
+    async def get_tariff_plan(self, plan_id="A1"):
+        """
+        Serve a TariffPlan from the process-wide TARIFF_CACHE. Only the periodic
+        version check touches the database, and that runs in a worker thread.
+        """
+        if TARIFF_CACHE.is_fresh():
+            return TARIFF_CACHE.get(self._sync, plan_id)
+        return await asyncio.to_thread(TARIFF_CACHE.get, self._sync, plan_id)
+
+    # -----------------------------
+    # Meter Readings & Commands
+    # -----------------------------
+    async def insert_meter_reading(self, meter_id, reading_datetime, kwh):
+        query = "INSERT IGNORE INTO meter_readings (meter_id, reading_datetime, kwh) VALUES (%s, %s, %s)"
+        await self._run_query(query, (meter_id, reading_datetime, kwh))
+
+    async def insert_meter_readings(self, readings, chunk_size=BULK_INSERT_CHUNK_SIZE):
+        """
+        Write a list of (meter_id, reading_datetime, kwh) tuples with one multi-row
+        INSERT per chunk_size readings. Readings already stored for the same
+        (meter_id, reading_datetime), or repeated within the payload, are skipped,
+        so a vendor can safely resend a payload. Each chunk commits on its own.
+        Returns (accepted, duplicates); errors propagate.
+        """
+        accepted = duplicates = 0
+        for start in range(0, len(readings), chunk_size):
+            chunk = readings[start:start + chunk_size]
+            query = ("INSERT IGNORE INTO meter_readings (meter_id, reading_datetime, kwh) VALUES "
+                     + ", ".join(["(%s, %s, %s)"] * len(chunk)))
+            async with self._connection() as conn:
+                async with conn.cursor() as cursor:
+                    await self._execute(cursor, query, [value for reading in chunk for value in reading])
+                    accepted += cursor.rowcount
+                    duplicates += len(chunk) - cursor.rowcount
+        return accepted, duplicates
+
+    async def insert_meter_command(self, meter_id, command_type):
+        """Queue a command for a meter; returns the new command id."""
+        query = """
+            INSERT INTO meter_commands (meter_id, command_type, status, command_datetime)
+            VALUES (%s, %s, 'PENDING', NOW())
+        """
+        return await self._run_query(query, (meter_id, command_type), lastrowid=True)
+
+    async def get_meter_command(self, command_id):
+        row = await self._run_query("""
+            SELECT id, meter_id, command_type, status, response_message
+            FROM meter_commands WHERE id = %s
+        """, (command_id,), fetchone=True)
+        return MeterCommand(*row) if row else None
+
+    # -----------------------------
+    # Billing
+    # -----------------------------
+    async def get_last_daily_billing_date(self):
+        row = await self._run_query(
+            "SELECT MAX(job_date) FROM daily_billing_job_status WHERE status = 'Completed'", fetchone=True)
+        return row[0] if row else None
+
+    async def generate_monthly_invoices(self, month, from_summary=False):
+        """Multi-statement batch write: delegated to DatabaseManager on a worker thread."""
+        return await asyncio.to_thread(self._sync.generate_monthly_invoices, month, from_summary)
@@ -0,0 +1,185 @@
+# recharge_benchmark.py - Concurrent recharge throughput on hot-spot consumers
+#
+# Usage (from the repo root, with the local MySQL from benchmarks/docker-compose.yml running):
+#   python benchmarks/recharge_benchmark.py --hot-consumers 1 10 100 --threads 32 --output recharge.json
+#
+# N threads credit a small set of "hot" consumers, as concurrent payment-gateway
+# callbacks do. Each run reports recharges per second (overall and per hot consumer),
+# latency percentiles, replayed duplicates and lost updates, i.e. money credited to
+# the ledger but missing from the balances. "atomic" is DatabaseManager.process_recharge;
+# "read_modify_write" is the old pattern of writing back a balance computed in Python.
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from billing_benchmark import DEFAULT_DB, git_commit, load, reset_schema
+
+AMOUNT = Decimal("10.00")
+PAYMENT_MODE = "UPI"
+
+
+# -----------------------------
+# Recharge Implementations
+# -----------------------------
+def atomic_recharge(db, consumer_id, transaction_ref):
+    result = db.process_recharge(consumer_id, AMOUNT, PAYMENT_MODE, transaction_ref)
+    return result.replayed
+
+
+def read_modify_write_recharge(db, consumer_id, transaction_ref):
+    """Baseline: balance read outside the transaction, new value computed in Python and written back."""
+    balance = db._run_query("SELECT balance FROM consumers WHERE consumer_id = %s", (consumer_id,), fetchone=True)[0]
+    with db.transaction() as cursor:
+        cursor.execute("""
+            INSERT INTO recharges (consumer_id, amount, payment_mode, transaction_ref, created_at)
+            VALUES (%s, %s, %s, %s, NOW())
+        """, (consumer_id, AMOUNT, PAYMENT_MODE, transaction_ref))
+        cursor.execute("UPDATE consumers SET balance = %s WHERE consumer_id = %s", (balance + AMOUNT, consumer_id))
+    return False
+
+
+MODES = {"atomic": atomic_recharge, "read_modify_write": read_modify_write_recharge}
+
+
+# -----------------------------
+# Workload
+# -----------------------------
+def workload(rng, hot_consumers, recharges, replay_rate, prefix):
+    """(consumer_id, transaction_ref) pairs; replay_rate of them repeat an earlier pair, like a retried callback."""
+    work = []
+    for i in range(recharges):
+        if work and rng.random() < replay_rate:
+            work.append(rng.choice(work))
+        else:
+            work.append((f"H{rng.randrange(hot_consumers):05d}", f"{prefix}-{i}"))
+    return work
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def run_once(db, mode, hot_consumers, args, results):
+    rng = random.Random(args.seed + hot_consumers)
+    db._run_query("DELETE FROM recharges")
+    db._run_query("UPDATE consumers SET balance = 0")
+    work = workload(rng, hot_consumers, args.recharges, args.replay_rate, f"{mode}-{hot_consumers}")
+    recharge = MODES[mode]
+
+    position = iter(work)
+    position_lock = threading.Lock()
+    latencies, errors, replayed = [], [], [0]
+    stats_lock = threading.Lock()
+
+    def worker():
+        local_latencies, local_replayed = [], 0
+        while True:
+            with position_lock:
+                item = next(position, None)
+            if item is None:
+                break
+            start = time.perf_counter()
+            try:
+                local_replayed += bool(recharge(db, *item))
+            except Exception as e:
+                with stats_lock:
+                    errors.append(str(e))
+                continue
+            local_latencies.append(time.perf_counter() - start)
+        with stats_lock:
+            latencies.extend(local_latencies)
+            replayed[0] += local_replayed
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    ledger_total, ledger_rows = db._run_query("SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM recharges", fetchone=True)
+    balance_total = db._run_query("SELECT COALESCE(SUM(balance), 0) FROM consumers", fetchone=True)[0]
+    latencies.sort()
+    completed = len(latencies)
+    result = {
+        "mode": mode,
+        "hot_consumers": hot_consumers,
+        "threads": args.threads,
+        "recharges": len(work),
+        "completed": completed,
+        "replayed": replayed[0],
+        "errors": len(errors),
+        "ledger_rows": ledger_rows,
+        "lost_updates": str(ledger_total - balance_total),
+        "seconds": round(seconds, 4),
+        "recharges_per_second": round(completed / seconds, 1) if seconds else None,
+        "per_consumer_per_second": round(completed / seconds / hot_consumers, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "sample_errors": errors[:5],
+    }
+    results.append(result)
+    print(f"⏱️  {mode:<18} hot={hot_consumers:<5} {result['recharges_per_second']:>9} rech/s  "
+          f"{result['per_consumer_per_second']:>9}/consumer  p99 {result['p99_ms']} ms  "
+          f"replayed {result['replayed']}  errors {result['errors']}  lost {result['lost_updates']}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent recharge benchmark on hot-spot consumers")
+    parser.add_argument("--db", default=os.getenv("BENCH_DB", DEFAULT_DB),
+                        help="MySQL URL of a disposable benchmark database (tables are dropped!)")
+    parser.add_argument("--hot-consumers", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--recharges", type=int, default=5000, help="Recharges per run")
+    parser.add_argument("--replay-rate", type=float, default=0.05, help="Fraction of retried (duplicate) callbacks")
+    parser.add_argument("--modes", nargs="+", default=["atomic", "read_modify_write"], choices=list(MODES))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="recharge_bench_output.json")
+    args = parser.parse_args()
+
+    # DatabaseManager reads DB and the pool size at import time; one connection per thread
+    os.environ["DB"] = args.db
+    os.environ["DB_POOL_SIZE"] = str(args.threads)
+    os.environ["DB_POOL_MAX_OVERFLOW"] = "0"
+    from database_manager import DatabaseManager
+
+    db = DatabaseManager()
+    reset_schema(db)
+    load(db, "consumers", ("consumer_id", "name", "balance", "status", "plan_id"),
+         ((f"H{i:05d}", f"Hot consumer {i}", 0, "Active", "A1") for i in range(max(args.hot_consumers))))
+
+    results = []
+    for hot_consumers in args.hot_consumers:
+        print(f"\n📊 Recharge benchmark: {hot_consumers} hot consumer(s), {args.threads} threads")
+        for mode in args.modes:
+            run_once(db, mode, hot_consumers, args, results)
+
+    report = {
+        "commit": git_commit(),
+        "run_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,34 @@
 import datetime
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from decimal import Decimal
-from database_manager import DatabaseManager
+from itertools import islice
+import numpy as np
+import pandas as pd
+from billing_metrics import BillingJobMetrics, log_event
+from database_manager import DatabaseManager, TARIFF_CACHE, summary_lock_name
+from query_metrics import QUERY_METRICS
 from prepaid_module_v2 import ConsumptionRecord  # Assuming you have this dataclass
 
+BULK_CHUNK_SIZE = 5000  # Consumers billed per multi-row INSERT / joined UPDATE
+
+
+def _is_active(consumer):
+    """Status check shared by both billing paths; case-insensitive, since 'ACTIVE' and 'Active' both occur."""
+    return (consumer.status or "").casefold() == "active"
+
+
+def _bill_shard_worker(args):
+    """
+    Process-pool entry point: each worker process builds its own BillingEngine
+    (and therefore its own connection pool) and bills one shard.
+    """
+    return BillingEngine().bill_shard(*args)
+
+
 class BillingEngine:
     def __init__(self):
         self.db = DatabaseManager()
@@ -10,47 +36,286 @@ class BillingEngine:
     # ---------------------------------
     # DAILY BILLING PROCESS
     # ---------------------------------
-    def run_daily_billing(self, billing_date=None):
+    def run_daily_billing(self, billing_date=None, bulk=False, chunk_size=BULK_CHUNK_SIZE, shards=1, workers=None,
+                          resume=False):
         """
         Main job: Run daily deduction for all active consumers.
+        With bulk=True, consumers are billed chunk-by-chunk in one vectorized pass
+        (see _bill_consumers_bulk) instead of three round trips per consumer.
+        With shards > 1, the consumer base is split by consumer_id hash and the
+        shards are billed by a process pool (see _run_sharded_daily_billing).
+        With resume=True, consumers already billed for billing_date are skipped, so a
+        rerun after an outage only bills the remaining consumers.
+
+        Every consumption record carries billing_date; the (consumer_id, billing_date)
+        unique key guarantees a consumer is never deducted twice for the same day.
+        The month's summary lock is held throughout (see rebuild_monthly_summary), so
+        billing runs for one month wait for each other. Returns (total, processed, failed).
         """
         if not billing_date:
             billing_date = datetime.date.today()
 
+        # Keeps a monthly summary rebuild from deleting summary rows while they are upserted
+        with self.db.named_lock(summary_lock_name(billing_date.strftime("%Y-%m"))):
+            if shards > 1:
+                return self._run_sharded_daily_billing(billing_date, shards, workers, bulk, chunk_size, resume)
+            return self._run_daily_billing(billing_date, bulk, chunk_size, resume)
+
+    def _run_daily_billing(self, billing_date, bulk, chunk_size, resume):
         print(f"🚀 Starting daily billing job for {billing_date}")
+        metrics = BillingJobMetrics("daily_billing")
 
-        consumers = self.db.get_all_consumers()
+        with metrics.phase("usage_fetch"):
+            usage = self.db.get_daily_usage(billing_date)
+        if usage is None:
+            # Billing from an empty map would bill nobody and still log the run Completed
+            raise RuntimeError(f"Daily usage for {billing_date} could not be loaded; billing aborted")
+        consumers = self.db.iter_consumers(unbilled_on=billing_date if resume else None)
+        total, processed, failed = self._bill_consumers(consumers, billing_date, usage, metrics, bulk, chunk_size)
+
+        # Log job summary
+        self._log_daily_job(billing_date, total, processed, failed, metrics.finish())
+
+        print(f"✅ Daily Billing Completed: {processed}/{total} processed, {failed} failed.")
+        print(f"📦 Tariff cache: {TARIFF_CACHE.stats()}")
+        log_event("daily_billing_queries", billing_date=billing_date, queries=QUERY_METRICS.top())
+        return total, processed, failed
+
+    def _bill_consumers(self, consumers, billing_date, usage, metrics, bulk=False, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Bill a stream of consumers for billing_date and return (total, processed, failed).
+        usage maps consumer_id -> kWh for the day (see DatabaseManager.get_daily_usage).
+        Phase timings and per-consumer latencies are recorded on metrics.
+        """
+        if bulk:
+            return self._bill_consumers_bulk(consumers, billing_date, usage, metrics, chunk_size)
+
+        total = 0
         processed = 0
         failed = 0
 
-        for consumer in consumers:
+        for consumer in metrics.timed_iter(consumers):
+            total += 1
+            started = time.perf_counter()
             try:
-                if consumer.status != "Active":
+                if not _is_active(consumer):
                     continue
 
-                tariff = self.db.get_tariff_plan(consumer.plan_id or "A1")
+                with metrics.phase("tariff_lookup"):
+                    tariff = self.db.get_tariff_plan(consumer.plan_id or "A1")
 
-                # Simulate daily energy consumption from MDM or estimated logic
-                kwh_used = self._fetch_daily_usage(consumer.consumer_id)
+                # Daily energy consumption derived from meter readings
+                kwh_used = usage.get(consumer.consumer_id, 0)
 
                 if kwh_used == 0:
                     continue
 
                 # --- Billing Logic ---
-                record = self._calculate_daily_deduction(consumer, tariff, kwh_used)
-                self.db.insert_consumption_record(record)
-                self.db.update_consumer_balance(consumer.consumer_id, record.balance_after)
+                with metrics.phase("calculation"):
+                    record = self._calculate_daily_deduction(consumer, tariff, kwh_used)
+                # Record + summary + balance update commit together, so db_write covers the balance update
+                with metrics.phase("db_write"):
+                    written = self.db.record_daily_deduction(record, billing_date)
+                if not written:
+                    # Already billed for this date: never deduct twice
+                    continue
 
                 processed += 1
+                metrics.record_consumer(consumer.consumer_id, time.perf_counter() - started)
 
             except Exception as e:
                 print(f"⚠️ Error processing consumer {consumer.consumer_id}: {e}")
                 failed += 1
 
-        # Log job summary
-        self._log_daily_job(billing_date, len(consumers), processed, failed)
+        return total, processed, failed
 
-        print(f"✅ Daily Billing Completed: {processed}/{len(consumers)} processed, {failed} failed.")
+    # ---------------------------------
+    # SHARDED DAILY BILLING
+    # ---------------------------------
+    def _run_sharded_daily_billing(self, billing_date, shard_count, workers=None, bulk=False, chunk_size=BULK_CHUNK_SIZE,
+                                   resume=False):
+        """
+        Bill every shard that has no 'Completed' checkpoint for billing_date on a
+        process pool. Rerunning after a crash only bills the unfinished shards;
+        shards left 'Running' (crashed) or 'Partial' (some consumers failed) are retried.
+        """
+        completed = self.db.get_completed_shards(billing_date, shard_count)
+        pending = [i for i in range(shard_count) if i not in completed]
+
+        print(f"🚀 Starting sharded daily billing job for {billing_date}: "
+              f"{len(pending)}/{shard_count} shards pending")
+        metrics = BillingJobMetrics("daily_billing_sharded")
+
+        results = list(completed.values())
+        if pending:
+            # spawn, not fork: children must not inherit the parent's pooled sockets
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = {
+                    pool.submit(_bill_shard_worker, (billing_date, i, shard_count, bulk, chunk_size, resume)): i
+                    for i in pending
+                }
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        print(f"⚠️ Shard {futures[future]}/{shard_count} crashed: {e}")
+
+        total = sum(r[0] for r in results)
+        processed = sum(r[1] for r in results)
+        failed = sum(r[2] for r in results)
+
+        if len(results) == shard_count:
+            # Phase detail lives on each shard's checkpoint row; the run row keeps wall time and throughput
+            self._log_daily_job(billing_date, total, processed, failed, metrics.finish())
+            print(f"✅ Sharded Daily Billing Completed: {processed}/{total} processed, {failed} failed.")
+            if failed:
+                print("↩️  Shards with failed consumers are checkpointed 'Partial'; rerun to retry them.")
+        else:
+            print(f"❌ Sharded Daily Billing incomplete: {shard_count - len(results)} shard(s) left, rerun to resume.")
+        return total, processed, failed
+
+    def bill_shard(self, billing_date, shard_index, shard_count, bulk=False, chunk_size=BULK_CHUNK_SIZE, resume=False):
+        """
+        Bill one hash shard of the consumer base and checkpoint it: 'Completed' when
+        every consumer was billed, 'Partial' when some failed, so the next run retries it.
+        A shard that already has a checkpoint is rerun with resume forced on, so
+        consumers billed by the earlier attempt are skipped instead of colliding with
+        the idempotency key (which would roll back whole bulk chunks).
+        Returns (total, processed, failed) for the shard.
+        """
+        if self.db.get_shard_status(billing_date, shard_index, shard_count) is not None:
+            resume = True
+        self.db.record_shard_checkpoint(billing_date, shard_index, shard_count, 0, 0, 0, "Running")
+        metrics = BillingJobMetrics(f"daily_billing_shard_{shard_index}_of_{shard_count}")
+
+        with metrics.phase("usage_fetch"):
+            usage = self.db.get_daily_usage(billing_date, shard_index=shard_index, shard_count=shard_count)
+        if usage is None:
+            # Leaves the 'Running' checkpoint, so the next run retries this shard
+            raise RuntimeError(f"Daily usage for {billing_date} shard {shard_index}/{shard_count} could not be loaded")
+        consumers = self.db.iter_consumers(unbilled_on=billing_date if resume else None,
+                                           shard_index=shard_index, shard_count=shard_count)
+        total, processed, failed = self._bill_consumers(consumers, billing_date, usage, metrics, bulk, chunk_size)
+
+        summary = metrics.finish().summary(total, processed, failed)
+        self.db.record_shard_checkpoint(billing_date, shard_index, shard_count,
+                                        total, processed, failed, "Partial" if failed else "Completed", summary)
+        log_event("daily_billing_shard_completed", billing_date=billing_date, **summary)
+        log_event("daily_billing_queries", billing_date=billing_date, shard_index=shard_index,
+                  queries=QUERY_METRICS.top())
+        print(f"✅ Shard {shard_index}/{shard_count}: {processed}/{total} processed, {failed} failed.")
+        return total, processed, failed
+
+    # ---------------------------------
+    # BULK DAILY BILLING
+    # ---------------------------------
+    def _bill_consumers_bulk(self, consumers, billing_date, usage, metrics, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Set-based daily billing: per chunk, compute every deduction in one pass over
+        columns and write the chunk with one INSERT and one joined UPDATE.
+        A chunk containing an already-billed consumer violates the idempotency key and
+        is rolled back as a whole; use resume=True to exclude those consumers up front.
+        Only one chunk of the consumer stream is held in memory at a time.
+        Per-consumer latency is the chunk's wall time amortized over its consumers.
+        Returns (total, processed, failed).
+        """
+        tariffs = {}
+        total = 0
+        processed = 0
+        failed = 0
+
+        consumers = metrics.timed_iter(consumers)
+        while True:
+            chunk = list(islice(consumers, chunk_size))
+            if not chunk:
+                break
+            total += len(chunk)
+            started = time.perf_counter()
+
+            chunk = [c for c in chunk if _is_active(c)]
+            if not chunk:
+                continue
+
+            try:
+                with metrics.phase("tariff_lookup"):
+                    for plan_id in {c.plan_id or "A1" for c in chunk} - tariffs.keys():
+                        tariffs[plan_id] = self.db.get_tariff_plan(plan_id)
+
+                # As on the per-consumer path, a consumer with usage but no tariff row fails alone
+                unpriced = [c for c in chunk
+                            if tariffs[c.plan_id or "A1"] is None and usage.get(c.consumer_id, 0) != 0]
+                if unpriced:
+                    print(f"⚠️ No tariff plan for {len(unpriced)} consumer(s), e.g. {unpriced[0].consumer_id} "
+                          f"(plan {unpriced[0].plan_id or 'A1'}); not billed")
+                    failed += len(unpriced)
+                chunk = [c for c in chunk if tariffs[c.plan_id or "A1"] is not None]
+                if not chunk:
+                    continue
+
+                with metrics.phase("calculation"):
+                    frame = pd.DataFrame({
+                        "consumer_id": [c.consumer_id for c in chunk],
+                        "plan_id": [c.plan_id or "A1" for c in chunk],
+                        "balance": [c.balance for c in chunk],
+                        "kwh_used": [usage.get(c.consumer_id, 0) for c in chunk],
+                    })
+                    frame = frame[frame["kwh_used"] != 0]
+                    records = self._calculate_bulk_deductions(frame, tariffs, billing_date) if not frame.empty else []
+                if not records:
+                    continue
+            except Exception as e:
+                print(f"⚠️ Error preparing chunk starting at consumer {chunk[0].consumer_id}: {e}")
+                failed += len(chunk)
+                continue
+
+            # Balance updates run inside the same statement batch, so they count as db_write
+            with metrics.phase("db_write"):
+                written = self.db.apply_daily_deductions(records)
+            processed += written
+            failed += len(records) - written
+
+            if written:
+                per_consumer = (time.perf_counter() - started) / written
+                for record in records:
+                    metrics.record_consumer(record[0], per_consumer)
+
+        return total, processed, failed
+
+    def _calculate_bulk_deductions(self, frame, tariffs, billing_date):
+        """
+        Vectorized equivalent of _calculate_daily_deduction for a whole chunk.
+        Returns consumption_records rows in apply_daily_deductions column order.
+
+        Columns are held as NumPy object arrays of Decimal, so each element goes through
+        exactly the same Decimal arithmetic as the per-consumer path.
+        """
+        plans = frame["plan_id"].to_numpy()
+        rate = np.array([Decimal(tariffs[p].rate_per_kwh) for p in plans], dtype=object)
+        fixed = np.array([Decimal(tariffs[p].fixed_charge_daily) for p in plans], dtype=object)
+        subsidy_cap = np.array([tariffs[p].subsidy_units or 0 for p in plans], dtype=object)
+        subsidy_rate = np.array([Decimal(tariffs[p].subsidy_rate) for p in plans], dtype=object)
+
+        kwh_used = frame["kwh_used"].to_numpy(dtype=object)
+        # Same tie-breaking as min(kwh_used, subsidy_cap)
+        subsidy_units = np.where(subsidy_cap < kwh_used, subsidy_cap, kwh_used)
+
+        to_decimal = np.frompyfunc(Decimal, 1, 1)
+        energy_charge = to_decimal(kwh_used) * rate
+        subsidy_amount = to_decimal(subsidy_units) * subsidy_rate
+        total_deduction = (energy_charge + fixed) - subsidy_amount
+
+        balance_before = to_decimal(frame["balance"].to_numpy(dtype=object))
+        balance_after = balance_before - total_deduction
+
+        timestamp = datetime.datetime.now()
+        return [
+            (consumer_id, billing_date, timestamp, *values)
+            for consumer_id, *values in zip(
+                frame["consumer_id"].to_numpy(), kwh_used, subsidy_units, energy_charge, fixed,
+                total_deduction, balance_before, balance_after,
+            )
+        ]
 
     # ---------------------------------
     # BILLING CALCULATION
@@ -68,10 +333,8 @@ class BillingEngine:
         balance_before = Decimal(consumer.balance)
         balance_after = balance_before - total_deduction
 
-        # Auto disconnection trigger logic (if balance is negative)
-        if balance_after <= 0:
-            consumer.status = "Disconnected"
-            self.db.update_consumer_balance(consumer.consumer_id, 0.00)
+        # No DB writes here: auto disconnection (updated balance <= 0) is applied by
+        # record_daily_deduction / apply_daily_deductions inside the billing transaction
 
         # Create consumption record
         record = ConsumptionRecord(
@@ -91,84 +354,65 @@ class BillingEngine:
     # ---------------------------------
     # MONTHLY BILLING / INVOICE
     # ---------------------------------
-    def run_monthly_invoice(self, month=None):
+    def run_monthly_invoice(self, month=None, from_summary=False):
         """
         Generate monthly invoice summary for each consumer.
+        With from_summary=True the totals come from the incrementally maintained
+        monthly_consumer_summary (see billing_maintenance.py rebuild-summary).
         """
         if not month:
             month = datetime.date.today().strftime("%Y-%m")
 
         print(f"📅 Generating monthly invoices for {month}")
-        consumers = self.db.get_all_consumers()
-
-        for consumer in consumers:
-            try:
-                # Fetch monthly consumption
-                history = self.db.get_consumption_history(consumer.consumer_id)
-                monthly_records = [r for r in history if r[0].strftime("%Y-%m") == month]
 
-                if not monthly_records:
-                    continue
-
-                total_units = sum([float(r[1]) for r in monthly_records])
-                total_energy_charge = sum([float(r[3]) for r in monthly_records])
-                total_fixed_charge = sum([float(r[4]) for r in monthly_records])
-                total_subsidy = sum([float(r[2]) for r in monthly_records])
-                total_amount = sum([float(r[5]) for r in monthly_records])
-                opening_balance = monthly_records[-1][6]
-                closing_balance = monthly_records[0][7]
-
-                # Insert invoice summary
-                self.db._run_query("""
-                    INSERT INTO invoices (consumer_id, billing_month, total_units, total_energy_charge, 
-                        total_fixed_charge, total_subsidy, total_amount, opening_balance, closing_balance)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (consumer.consumer_id, month, total_units, total_energy_charge,
-                      total_fixed_charge, total_subsidy, total_amount,
-                      opening_balance, closing_balance))
-
-            except Exception as e:
-                print(f"⚠️ Error generating invoice for {consumer.consumer_id}: {e}")
+        # One grouped query over the month's records (or its summary rows), then multi-row INSERTs
+        written = self.db.generate_monthly_invoices(month, from_summary=from_summary)
 
-        print(f"✅ Monthly invoices generated successfully for {month}")
+        print(f"✅ Monthly invoices generated successfully for {month}: {written} invoices")
 
     # ---------------------------------
-    # RMS / MDM SYNC MOCK
+    # RMS / MDM SYNC
     # ---------------------------------
-    def sync_invoices_with_rms(self):
+    def sync_invoices_with_rms(self, rms_url=None):
         """
-        Sync unsynced invoices to RMS/MDM system (mock).
+        Sync unsynced invoices to the RMS/MDM system.
+        With an RMS URL (argument or RMS_URL env), invoices are pushed through the
+        concurrent, batched RMSSync pipeline; otherwise they are marked Synced (mock).
+        Status changes are written back with one UPDATE per status.
         """
-        invoices = self.db._run_query("SELECT invoice_id, consumer_id, total_amount FROM invoices WHERE sync_status='Pending'", fetch=True)
+        invoices = self.db.get_pending_invoices()
         if not invoices:
             print("No pending invoices to sync.")
             return
 
-        for inv in invoices:
-            invoice_id, consumer_id, amount = inv
-            try:
-                # Here, you would call the external RMS/MDM API
-                print(f"🔁 Syncing invoice {invoice_id} for {consumer_id} ...")
-                # simulate success
-                self.db._run_query("UPDATE invoices SET sync_status='Synced' WHERE invoice_id=%s", (invoice_id,))
-            except Exception as e:
-                print(f"❌ Sync failed for invoice {invoice_id}: {e}")
-                self.db._run_query("UPDATE invoices SET sync_status='Failed' WHERE invoice_id=%s", (invoice_id,))
+        rms_url = rms_url or os.getenv("RMS_URL")
+        if not rms_url:
+            # No RMS configured: simulate success
+            self.db.update_invoice_sync_status([inv[0] for inv in invoices], "Synced")
+            print(f"✅ RMS/MDM sync completed (mock): {len(invoices)} invoices.")
+            return
+
+        from rms_sync import RMSSync
+
+        print(f"🔁 Syncing {len(invoices)} invoices with RMS @ {rms_url} ...")
+        synced, failed, seconds = RMSSync(rms_url).run(invoices)
 
-        print("✅ RMS/MDM sync completed.")
+        self.db.update_invoice_sync_status(synced, "Synced")
+        self.db.update_invoice_sync_status(failed, "Failed")
+
+        rate = len(invoices) / seconds if seconds else 0
+        print(f"✅ RMS/MDM sync completed: {len(synced)} synced, {len(failed)} failed "
+              f"in {seconds:.2f}s ({rate:.0f} invoices/s).")
 
     # ---------------------------------
     # UTILITIES
     # ---------------------------------
-    def _fetch_daily_usage(self, consumer_id):
-        """
-        Fetch or simulate daily kWh consumption (replace with real API later).
-        """
-        import random
-        return round(random.uniform(2.5, 8.0), 3)  # Simulated 2.5 to 8 kWh daily usage
-
-    def _log_daily_job(self, job_date, total, processed, failed):
+    def _log_daily_job(self, job_date, total, processed, failed, metrics):
+        summary = metrics.summary(total, processed, failed)
         self.db._run_query("""
-            INSERT INTO daily_billing_job_status (job_date, total_consumers, processed, failed, status, started_at, finished_at)
-            VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-        """, (job_date, total, processed, failed, 'Completed'))
+            INSERT INTO daily_billing_job_status
+            (job_date, total_consumers, processed, failed, status, started_at, finished_at, metrics_json)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (job_date, total, processed, failed, 'Completed', metrics.started_at, metrics.finished_at,
+              json.dumps(summary)))
+        log_event("daily_billing_completed", billing_date=job_date, **summary)
@@ -0,0 +1,154 @@
+# billing_maintenance.py - Maintenance commands for billing data
+#
+# Run `partition-maintenance` daily (cron): it keeps month partitions ready ahead of
+# time, rolls expired raw meter readings up into meter_readings_daily, and archives
+# expired partitions to gzip CSV files before dropping them.
+import argparse
+import csv
+import datetime
+import gzip
+import os
+from database_manager import PARTITION_KEYS, PARTITION_MONTHS_AHEAD, USAGE_LOOKBACK_DAYS, DatabaseManager, add_months
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+CONSUMPTION_RETENTION_MONTHS = int(os.getenv("CONSUMPTION_RETENTION_MONTHS", "24"))
+# Raw readings must outlive the usage derivation lookback window
+READINGS_RETENTION_DAYS = max(int(os.getenv("READINGS_RETENTION_DAYS", "92")), USAGE_LOOKBACK_DAYS + 1)
+
+
+def rebuild_summary(db, args):
+    """Recompute monthly_consumer_summary from raw consumption_records."""
+    scope = args.month or "all months"
+    print(f"🔧 Rebuilding monthly consumer summary for {scope}")
+    written = db.rebuild_monthly_summary(args.month)
+    if written is None:
+        print("❌ Rebuild failed, the failed month's summary left unchanged.")
+    else:
+        print(f"✅ Monthly summary rebuilt: {written} rows")
+
+
+# -----------------------------
+# Partition Maintenance
+# -----------------------------
+def retention_cutoffs(today=None):
+    """{table: date} before which a whole partition is expired."""
+    today = today or datetime.date.today()
+    return {
+        "consumption_records": add_months(today, -CONSUMPTION_RETENTION_MONTHS),
+        "meter_readings": today - datetime.timedelta(days=READINGS_RETENTION_DAYS),
+    }
+
+
+def create_partitions(db, args):
+    """Make sure month partitions exist through --months-ahead months from now."""
+    for table in PARTITION_KEYS:
+        added = db.add_future_partitions(table, args.months_ahead, dry_run=args.dry_run)
+        if args.dry_run:
+            print(f"🔍 {table}: would add {len(added)} partition(s) {', '.join(added)}".rstrip())
+        else:
+            print(f"✅ {table}: {len(added)} partition(s) added {', '.join(added)}".rstrip())
+
+
+def rollup_readings(db, args):
+    """Compact every expired meter_readings partition into meter_readings_daily."""
+    ok = True
+    for partition in db.expired_partitions("meter_readings", retention_cutoffs()["meter_readings"]):
+        written = db.rollup_meter_readings(partition)
+        if written is None:
+            print(f"❌ meter_readings {partition}: rollup failed")
+            ok = False
+        else:
+            print(f"✅ meter_readings {partition}: {written} daily rollup rows written")
+    return ok
+
+
+def archive_partition(db, table, partition, archive_dir):
+    """
+    Export one partition to <archive_dir>/<table>/<table>-<partition>.csv.gz and drop it
+    once the archived row count matches the partition. Returns rows archived, or None.
+    """
+    columns = db.get_table_columns(table)
+    expected = db.count_partition_rows(table, partition)
+    if not columns or expected is None:
+        print(f"❌ {table} {partition}: could not read partition")
+        return None
+
+    os.makedirs(os.path.join(archive_dir, table), exist_ok=True)
+    path = os.path.join(archive_dir, table, f"{table}-{partition}.csv.gz")
+    written = 0
+    try:
+        with gzip.open(path + ".tmp", "wt", newline="") as archive:
+            writer = csv.writer(archive)
+            writer.writerow(columns)
+            for row in db.iter_partition_rows(table, partition, columns):
+                writer.writerow(row)
+                written += 1
+    except Exception as e:
+        os.remove(path + ".tmp")
+        print(f"❌ {table} {partition}: export failed after {written} rows ({e}), partition kept")
+        return None
+
+    if written != expected:
+        os.remove(path + ".tmp")
+        print(f"❌ {table} {partition}: archived {written} of {expected} rows, partition kept")
+        return None
+    os.replace(path + ".tmp", path)
+    db.drop_partition(table, partition)
+    print(f"📦 {table} {partition}: {written} rows archived to {path}, partition dropped")
+    return written
+
+
+def archive_partitions(db, args):
+    """Archive and drop expired partitions (meter_readings only once rolled up)."""
+    cutoffs = retention_cutoffs()
+    if not args.dry_run and not rollup_readings(db, args):
+        # Never drop raw readings whose rollup failed
+        cutoffs.pop("meter_readings")
+    for table, before in cutoffs.items():
+        for partition in db.expired_partitions(table, before):
+            if args.dry_run:
+                print(f"🔍 {table} {partition}: would archive {db.count_partition_rows(table, partition)} rows")
+            else:
+                archive_partition(db, table, partition, args.archive_dir)
+
+
+def partition_maintenance(db, args):
+    create_partitions(db, args)
+    archive_partitions(db, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Billing data maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-summary", help="Recompute monthly_consumer_summary from raw records")
+    rebuild.add_argument("--month", help="Billing month as YYYY-MM (default: all months with raw records)")
+    rebuild.set_defaults(handler=rebuild_summary)
+
+    partitions = commands.add_parser("create-partitions", help="Add month partitions ahead of time")
+    partitions.set_defaults(handler=create_partitions)
+
+    rollup = commands.add_parser("rollup-readings", help="Roll expired raw meter readings up into daily rows")
+    rollup.set_defaults(handler=rollup_readings)
+
+    archive = commands.add_parser("archive-partitions", help="Archive expired partitions to gzip CSV and drop them")
+    archive.set_defaults(handler=archive_partitions)
+
+    maintenance = commands.add_parser("partition-maintenance", help="create-partitions + rollup + archive (daily)")
+    maintenance.set_defaults(handler=partition_maintenance)
+
+    for command in (partitions, maintenance):
+        command.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD,
+                             help=f"Month partitions to keep ready (default {PARTITION_MONTHS_AHEAD})")
+    for command in (archive, maintenance):
+        command.add_argument("--archive-dir", default=ARCHIVE_DIR, help=f"Archive location (default {ARCHIVE_DIR})")
+    for command in (partitions, archive, maintenance):
+        command.add_argument("--dry-run", action="store_true",
+                             help="Report the partitions that would be added or archived, change nothing")
+
+    args = parser.parse_args()
+    args.handler(DatabaseManager(), args)
+
+
+if __name__ == "__main__":
+    main()
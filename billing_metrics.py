@@ -0,0 +1,111 @@
+# billing_metrics.py - Phase timing and throughput metrics for billing jobs
+import heapq
+import json
+import logging
+import os
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger("billing")
+
+PHASES = ("consumer_fetch", "usage_fetch", "tariff_lookup", "calculation", "db_write")
+SLOWEST_CONSUMERS = 10
+BILLING_LOG_LEVEL = os.getenv("BILLING_LOG_LEVEL", "INFO")   # Level of the "billing" job events
+
+
+def configure_logging(level=BILLING_LOG_LEVEL):
+    """
+    Log to stderr for the job entry points: "billing" events at level, everything
+    else (e.g. the "db.slow" slow-query log) at WARNING. No-op if logging is set up.
+    """
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    logger.setLevel(level)
+
+
+def log_event(event, **fields):
+    """Emit one structured (JSON) log line for the billing job."""
+    logger.info(json.dumps({"event": event, **fields}, default=str))
+
+
+class BillingJobMetrics:
+    """
+    Collects wall time per billing phase, per-consumer latencies and the slowest
+    consumers of one job run. summary() is what gets stored with the job status.
+    """
+
+    def __init__(self, job, slowest=SLOWEST_CONSUMERS):
+        self.job = job
+        self.started_at = datetime.now()
+        self.finished_at = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.latencies = array("d")
+        self._slowest = []  # min-heap of (seconds, consumer_id)
+        self._slowest_size = slowest
+        self._start = time.perf_counter()
+        self._elapsed = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def timed_iter(self, iterable, name="consumer_fetch"):
+        """Wrap a (streaming) iterator so the time spent fetching items counts toward a phase."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.phases[name] += time.perf_counter() - start
+                return
+            self.phases[name] += time.perf_counter() - start
+            yield item
+
+    def record_consumer(self, consumer_id, seconds):
+        self.latencies.append(seconds)
+        entry = (seconds, consumer_id)
+        if len(self._slowest) < self._slowest_size:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def finish(self):
+        self._elapsed = time.perf_counter() - self._start
+        self.finished_at = datetime.now()
+        return self
+
+    def percentiles(self, *pcts):
+        """Nearest-rank latency percentiles in seconds, from one sort of the samples."""
+        if not self.latencies:
+            return [0.0] * len(pcts)
+        ordered = sorted(self.latencies)
+        return [ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] for pct in pcts]
+
+    def summary(self, total=0, processed=0, failed=0):
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._start
+        p50, p95, p99, p100 = self.percentiles(50, 95, 99, 100)
+        return {
+            "job": self.job,
+            "wall_seconds": round(elapsed, 3),
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "total": total,
+            "processed": processed,
+            "failed": failed,
+            "consumers_per_second": round(processed / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(p50 * 1000, 3),
+                "p95": round(p95 * 1000, 3),
+                "p99": round(p99 * 1000, 3),
+                "max": round(p100 * 1000, 3),
+            },
+            "slowest_consumers": [
+                {"consumer_id": consumer_id, "ms": round(seconds * 1000, 3)}
+                for seconds, consumer_id in sorted(self._slowest, reverse=True)
+            ],
+        }
@@ -1,19 +1,26 @@
-# daily_billing_job.py
-from billing_engine import BillingEngine
-from random import uniform
+# daily_billing_job.py - Nightly entry point: daily billing, plus last month's invoices on the 1st
+import datetime
+from billing_metrics import configure_logging
 
-def simulate_daily_consumption(consumer):
+
+def main(engine=None, today=None):
     """
-    Simulate daily consumption in kWh for testing.
-    You can later replace this with smart meter input.
+    Bill today's usage (derived from meter readings) and, on the 1st of the month,
+    generate the invoices for the month that just ended. Returns (total, processed, failed).
     """
-    return round(uniform(1.5, 6.0), 2)  # Example: 1.5–6.0 kWh per day
+    if engine is None:
+        from billing_engine import BillingEngine  # numpy/pandas are only needed when billing for real
 
-if __name__ == "__main__":
-    billing_engine = BillingEngine()
-    billing_engine.process_daily_billing(simulated_consumption_fn=simulate_daily_consumption)
+        engine = BillingEngine()
+    today = today or datetime.date.today()
+
+    result = engine.run_daily_billing(today)
 
-    # Optional: Generate invoices on 1st of month
-    from datetime import datetime
-    if datetime.now().day == 1:
-        billing_engine.generate_monthly_invoices()
+    if today.day == 1:
+        engine.run_monthly_invoice((today - datetime.timedelta(days=1)).strftime("%Y-%m"))
+    return result
+
+
+if __name__ == "__main__":
+    configure_logging()
+    main()
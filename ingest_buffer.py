@@ -0,0 +1,288 @@
+# ingest_buffer.py - Write-behind buffer that coalesces meter readings across requests
+#
+# Endpoints enqueue readings and acknowledge as soon as they are appended to a
+# local spool segment and fsynced (one fsync covers a group of concurrent appends).
+# A background flusher seals the active segment once INGEST_FLUSH_ROWS readings are
+# pending or the oldest has waited INGEST_FLUSH_SECONDS, writes it to meter_readings
+# in one transaction and deletes it. Segments left behind by a crash are replayed on start-up; the unique
+# (meter_id, reading_datetime) key makes a replay of already-written rows a no-op.
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: no segment locking, so one process per spool directory
+    fcntl = None
+
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "spool")
+INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "5000"))          # Flush once this many readings are pending
+INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "1.0"))   # ...or once the oldest has waited this long
+INGEST_MAX_BACKLOG = int(os.getenv("INGEST_MAX_BACKLOG", "200000"))      # Readings not yet in the DB before enqueue refuses
+INGEST_FSYNC = os.getenv("INGEST_FSYNC", "1") == "1"                     # fsync each enqueue before acknowledging
+INGEST_RETRY_SECONDS = 5                                                 # Pause after a failed flush
+
+
+class IngestBacklogFull(Exception):
+    """The flusher is too far behind; the caller should ask the client to retry later."""
+
+
+def _lock(handle):
+    """Take an exclusive lock on a segment; False if another live process holds it."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class ReadingBuffer:
+    """
+    Durable in-process queue in front of meter_readings. `writer` receives a list of
+    (meter_id, reading_datetime, kwh) tuples and must raise on failure, e.g.
+    DatabaseManager().insert_meter_readings; a failed segment stays spooled and is retried.
+    """
+
+    def __init__(self, name, writer, spool_dir=INGEST_SPOOL_DIR, flush_rows=INGEST_FLUSH_ROWS,
+                 flush_seconds=INGEST_FLUSH_SECONDS, max_backlog=INGEST_MAX_BACKLOG, fsync=INGEST_FSYNC):
+        self.name = name
+        self.writer = writer
+        self.spool_dir = spool_dir
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_backlog = max_backlog
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._segment = None       # (path, handle) being appended to
+        self._pending = []         # Readings in the active segment
+        self._oldest = None        # monotonic time the first pending reading arrived
+        self._sealed = deque()     # (path, handle, readings) waiting to be written
+        self._backlog = 0          # Readings acknowledged but not yet in the DB
+        self._sequence = 0
+        self._sync_lock = threading.Lock()  # Held by the one thread running the group fsync
+        self._appended = 0         # Appends so far...
+        self._synced = 0           # ...and how many of them are known durable
+        self._unsynced = set()     # Segment handles with appends not yet fsynced
+        self._thread = None
+        self._closing = False
+        self._stats = {"enqueued": 0, "written": 0, "duplicates": 0, "flushes": 0, "failures": 0,
+                       "rejected": 0, "replayed": 0, "last_error": None, "last_flush_at": None}
+
+    # -----------------------------
+    # Producer Side
+    # -----------------------------
+    def enqueue(self, readings):
+        """
+        Durably accept (meter_id, reading_datetime, kwh) readings; returns how many.
+        Raises IngestBacklogFull when the backlog would exceed max_backlog.
+        The append happens under the buffer lock, the fsync outside it (see _sync).
+        """
+        rows = [(meter_id, reading_datetime, float(kwh)) for meter_id, reading_datetime, kwh in readings]
+        if not rows:
+            return 0
+        data = "".join(json.dumps([meter_id, reading_datetime.isoformat(), kwh]) + "\n"
+                       for meter_id, reading_datetime, kwh in rows).encode()
+        self.start()
+        with self._lock:
+            if self._backlog + len(rows) > self.max_backlog:
+                self._stats["rejected"] += len(rows)
+                raise IngestBacklogFull(f"{self._backlog} readings are waiting to be written")
+            handle = self._segment[1]
+            handle.write(data)
+            handle.flush()
+            self._appended += 1
+            sequence = self._appended
+            if self.fsync:
+                self._unsynced.add(handle)
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.extend(rows)
+            self._backlog += len(rows)
+            self._stats["enqueued"] += len(rows)
+            if len(self._pending) >= self.flush_rows:
+                self._wakeup.notify()
+        if self.fsync:
+            self._sync(sequence)
+        return len(rows)
+
+    def _sync(self, sequence):
+        """
+        Group commit: return once append number `sequence` is on disk. One thread at a
+        time fsyncs every segment appended to since the last fsync; the appends that
+        queued behind it find themselves covered and return without a disk flush.
+        """
+        with self._sync_lock:
+            if self._synced >= sequence:
+                return
+            with self._lock:
+                target = self._appended
+                handles, self._unsynced = self._unsynced, set()
+            try:
+                for handle in handles:
+                    try:
+                        os.fsync(handle.fileno())
+                    except (ValueError, OSError):
+                        if not handle.closed:
+                            raise
+                        # Closed by the flusher once its readings reached the DB, or by close()
+            except Exception:
+                with self._lock:
+                    self._unsynced |= handles
+                raise
+            self._synced = target
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def start(self):
+        """Replay orphaned segments and start the flusher (idempotent; enqueue calls it)."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._replay()
+            self._open_segment()
+            self._closing = False
+            self._thread = threading.Thread(target=self._run, name=f"ingest-{self.name}", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=30):
+        """Flush what is pending and stop; anything the DB did not take stays spooled for the next start."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._closing = True
+            self._wakeup.notify()
+            thread = self._thread
+        thread.join(timeout)
+        if thread.is_alive():
+            # Still inside a write; its segments stay spooled and are replayed by the next start
+            print(f"⚠️ Ingest flusher {self.name} still writing after {timeout}s; not waiting for it")
+            return
+        with self._lock:
+            self._thread = None
+            path, handle = self._segment
+            handle.close()
+            if not self._pending:
+                os.remove(path)
+            for _, handle, _ in self._sealed:
+                handle.close()  # Releases the lock so the next start replays them
+            self._sealed.clear()
+            self._pending = []
+            self._backlog = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "pending": len(self._pending),
+                "sealed_segments": len(self._sealed),
+                "backlog": self._backlog,
+                "max_backlog": self.max_backlog,
+                "running": self._thread is not None,
+            }
+
+    # -----------------------------
+    # Spool Segments
+    # -----------------------------
+    def _open_segment(self):
+        while True:
+            self._sequence += 1
+            path = os.path.join(self.spool_dir, f"{self.name}-{os.getpid()}-{self._sequence:08d}.spool")
+            try:
+                handle = open(path, "xb")  # Never reuse a name a replayed segment still holds
+                break
+            except FileExistsError:
+                continue
+        _lock(handle)
+        self._segment = (path, handle)
+
+    def _seal(self):
+        """Hand the active segment to the flusher and start a new one (caller holds the lock)."""
+        path, handle = self._segment
+        self._sealed.append((path, handle, self._pending))
+        self._pending = []
+        self._oldest = None
+        self._open_segment()
+
+    def _replay(self):
+        """Queue segments no live process holds: a previous run crashed or stopped before writing them."""
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, f"{self.name}-*.spool"))):
+            try:
+                handle = open(path, "rb")
+            except FileNotFoundError:
+                continue  # Written and removed by its owner since the glob
+            if not _lock(handle):
+                handle.close()
+                continue
+            rows = []
+            for line in handle:
+                try:
+                    meter_id, reading_datetime, kwh = json.loads(line)
+                    rows.append((meter_id, datetime.datetime.fromisoformat(reading_datetime), kwh))
+                except ValueError:
+                    # Torn final line of a crashed write; it was never acknowledged
+                    continue
+            if not rows:
+                handle.close()
+                os.remove(path)
+                continue
+            print(f"🔁 Replaying {len(rows)} spooled readings from {path}")
+            self._sealed.append((path, handle, rows))
+            self._backlog += len(rows)
+            self._stats["replayed"] += len(rows)
+
+    # -----------------------------
+    # Flusher
+    # -----------------------------
+    def _due(self):
+        if not self._pending:
+            return False
+        return (len(self._pending) >= self.flush_rows or self._closing
+                or time.monotonic() - self._oldest >= self.flush_seconds)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._sealed and not self._due() and not self._closing:
+                    timeout = None
+                    if self._pending:
+                        timeout = max(self.flush_seconds - (time.monotonic() - self._oldest), 0)
+                    self._wakeup.wait(timeout)
+                if self._due():
+                    self._seal()
+                if not self._sealed:
+                    return  # Closing with nothing left to write
+                path, handle, rows = self._sealed[0]
+
+            try:
+                accepted, duplicates = self.writer(rows)
+            except Exception as e:
+                with self._lock:
+                    self._stats["failures"] += 1
+                    self._stats["last_error"] = str(e)
+                    closing = self._closing
+                print(f"⚠️ Ingest flush failed, {len(rows)} readings kept in {path}: {e}")
+                if closing:
+                    return
+                time.sleep(INGEST_RETRY_SECONDS)
+                continue
+
+            with self._lock:
+                self._sealed.popleft()
+                self._backlog -= len(rows)
+                self._stats["written"] += accepted
+                self._stats["duplicates"] += duplicates
+                self._stats["flushes"] += 1
+                self._stats["last_flush_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+            os.remove(path)
+            handle.close()
@@ -0,0 +1,407 @@
+# migrations.py - Versioned schema for the billing, NSC and AMISP vendor tables
+#
+# Usage:
+#   python migrations.py upgrade   # apply pending migrations
+#   python migrations.py status    # list applied / pending versions
+#   python migrations.py check     # EXPLAIN the hot queries and report full table scans
+#
+# This module owns the schema for both DatabaseManager and Secure_amisp/database.py.
+# Each migration runs once per database and is recorded in schema_migrations. Steps
+# are written to be safe on databases whose tables were created by hand before.
+import argparse
+import datetime
+import sys
+from database_manager import PARTITION_KEYS, DatabaseManager
+
+# Every table owned here, children before parents (drop order)
+TABLES = [
+    "meter_readings_daily", "vendor_audit_logs", "vendor_api_keys", "meter_commands", "payments", "recharges", "nsc_applications",
+    "consumption_records", "monthly_consumer_summary", "invoices", "daily_billing_job_status",
+    "meter_readings", "meters", "consumers", "tariff_plan", "Sections", "Subdivisions", "Divisions", "Circles",
+]
+
+BASE_SCHEMA = [
+    # --- Location hierarchy ---
+    """CREATE TABLE IF NOT EXISTS Circles (CircleID INT PRIMARY KEY, CircleName VARCHAR(100))""",
+    """CREATE TABLE IF NOT EXISTS Divisions (DivisionID INT PRIMARY KEY, DivisionName VARCHAR(100), CircleID INT)""",
+    """CREATE TABLE IF NOT EXISTS Subdivisions (
+        SubdivisionID INT PRIMARY KEY, SubdivisionName VARCHAR(100), DivisionID INT)""",
+    """CREATE TABLE IF NOT EXISTS Sections (SectionID INT PRIMARY KEY, SectionName VARCHAR(100), SubdivisionID INT)""",
+    # --- Billing (DatabaseManager) ---
+    """CREATE TABLE IF NOT EXISTS tariff_plan (
+        plan_id VARCHAR(10) PRIMARY KEY, rate_per_kwh DECIMAL(10,4), fixed_charge_daily DECIMAL(10,2),
+        low_balance_threshold DECIMAL(10,2), subsidy_units DECIMAL(10,3), subsidy_rate DECIMAL(10,4),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP)""",
+    """CREATE TABLE IF NOT EXISTS consumers (
+        consumer_id VARCHAR(50) PRIMARY KEY, name VARCHAR(100), address VARCHAR(255), phone VARCHAR(20),
+        balance DECIMAL(14,4) DEFAULT 0, status VARCHAR(20) DEFAULT 'Active', plan_id VARCHAR(10), SectionID INT)""",
+    """CREATE TABLE IF NOT EXISTS meters (
+        meter_id VARCHAR(50) PRIMARY KEY, consumer_id VARCHAR(50), install_date DATETIME,
+        status VARCHAR(20) DEFAULT 'PENDING_INSTALL')""",
+    """CREATE TABLE IF NOT EXISTS meter_readings (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY, meter_id VARCHAR(50), reading_datetime DATETIME, kwh DOUBLE)""",
+    """CREATE TABLE IF NOT EXISTS consumption_records (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY, consumer_id VARCHAR(50), billing_date DATE, timestamp DATETIME,
+        kwh_used DECIMAL(14,4), subsidy_units DECIMAL(14,4), energy_charge DECIMAL(14,4), fixed_charge DECIMAL(14,4),
+        total_deduction DECIMAL(14,4), balance_before DECIMAL(14,4), balance_after DECIMAL(14,4))""",
+    """CREATE TABLE IF NOT EXISTS monthly_consumer_summary (
+        consumer_id VARCHAR(50), billing_month CHAR(7), total_units DECIMAL(16,4), total_energy_charge DECIMAL(16,4),
+        total_fixed_charge DECIMAL(16,4), total_subsidy DECIMAL(16,4), total_amount DECIMAL(16,4),
+        opening_balance DECIMAL(14,4), closing_balance DECIMAL(14,4), first_record_at DATETIME,
+        last_record_at DATETIME, record_count INT, PRIMARY KEY (consumer_id, billing_month))""",
+    """CREATE TABLE IF NOT EXISTS invoices (
+        invoice_id BIGINT AUTO_INCREMENT PRIMARY KEY, consumer_id VARCHAR(50), billing_month CHAR(7),
+        total_units DECIMAL(16,4), total_energy_charge DECIMAL(16,4), total_fixed_charge DECIMAL(16,4),
+        total_subsidy DECIMAL(16,4), total_amount DECIMAL(16,4), opening_balance DECIMAL(14,4),
+        closing_balance DECIMAL(14,4), sync_status VARCHAR(20) DEFAULT 'Pending')""",
+    """CREATE TABLE IF NOT EXISTS daily_billing_job_status (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY, job_date DATE, shard_index INT NULL, shard_count INT NULL,
+        total_consumers INT, processed INT, failed INT, status VARCHAR(20), started_at DATETIME,
+        finished_at DATETIME NULL, metrics_json JSON NULL)""",
+    """CREATE TABLE IF NOT EXISTS recharges (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY, consumer_id VARCHAR(50), amount DECIMAL(14,4),
+        payment_mode VARCHAR(30), transaction_ref VARCHAR(100), created_at DATETIME)""",
+    # --- NSC (nsc_app) ---
+    """CREATE TABLE IF NOT EXISTS nsc_applications (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY, reference_number VARCHAR(20), name VARCHAR(100), phone VARCHAR(20),
+        address VARCHAR(255), category VARCHAR(50), circle VARCHAR(100), division VARCHAR(100),
+        subdivision VARCHAR(100), section VARCHAR(100), document_path VARCHAR(255),
+        status VARCHAR(30) DEFAULT 'Pending', verified_load DECIMAL(10,2) NULL, verified_category VARCHAR(50) NULL,
+        meter_number VARCHAR(50) NULL, account_number VARCHAR(50) NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+    # --- AMISP vendor simulator (Secure_amisp/database.py models) ---
+    """CREATE TABLE IF NOT EXISTS payments (
+        id INT AUTO_INCREMENT PRIMARY KEY, consumer_id VARCHAR(50), amount FLOAT,
+        transaction_ref VARCHAR(100) UNIQUE, payment_date DATETIME)""",
+    """CREATE TABLE IF NOT EXISTS vendor_api_keys (
+        vendor_id VARCHAR(20) PRIMARY KEY, api_key_hash VARCHAR(255), is_active BOOLEAN DEFAULT TRUE)""",
+    """CREATE TABLE IF NOT EXISTS vendor_audit_logs (
+        id INT AUTO_INCREMENT PRIMARY KEY, vendor_id VARCHAR(20), endpoint VARCHAR(100),
+        request_data VARCHAR(2048), response_status INT, log_datetime DATETIME)""",
+    """CREATE TABLE IF NOT EXISTS meter_commands (
+        id INT AUTO_INCREMENT PRIMARY KEY, meter_id VARCHAR(50), command_type VARCHAR(50),
+        status VARCHAR(20) DEFAULT 'PENDING', command_datetime DATETIME, response_message VARCHAR(255) NULL)""",
+]
+
+# (table, index name, columns, unique) for every predicate the application filters, joins or sorts on
+INDEXES = [
+    ("consumption_records", "uq_consumption_consumer_billing_date", "consumer_id, billing_date", True),
+    ("consumption_records", "idx_consumption_consumer_timestamp", "consumer_id, timestamp", False),
+    ("consumption_records", "idx_consumption_timestamp", "timestamp", False),
+    ("meter_readings", "idx_meter_readings_meter_datetime", "meter_id, reading_datetime", False),
+    ("meter_readings", "idx_meter_readings_datetime", "reading_datetime", False),
+    ("meters", "idx_meters_consumer", "consumer_id", False),
+    ("invoices", "idx_invoices_sync_status", "sync_status", False),
+    ("daily_billing_job_status", "uq_job_status_shard", "job_date, shard_index, shard_count", True),
+    ("nsc_applications", "uq_nsc_reference_number", "reference_number", True),
+    ("nsc_applications", "idx_nsc_status_created", "status, created_at", False),
+    ("nsc_applications", "idx_nsc_created", "created_at", False),
+    ("meter_commands", "idx_meter_commands_status", "status", False),
+    ("vendor_api_keys", "idx_vendor_api_keys_hash", "api_key_hash", False),
+]
+
+
+# -----------------------------
+# Helpers
+# -----------------------------
+def _execute(db, statement, params=(), fetch=False):
+    """Run one statement and let errors propagate (unlike DatabaseManager._run_query)."""
+    conn = db.pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(statement, params)
+        return cursor.fetchall() if fetch else None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _column_exists(db, table, column):
+    return _execute(db, """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column), fetch=True)[0][0] > 0
+
+
+def _index_exists(db, table, index):
+    return _execute(db, """
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index), fetch=True)[0][0] > 0
+
+
+# -----------------------------
+# Migrations
+# -----------------------------
+def _base_schema(db):
+    for ddl in BASE_SCHEMA:
+        _execute(db, ddl)
+
+
+def _billing_idempotency_key(db):
+    """Tables created before billing_date existed: add it and backfill from the record timestamp."""
+    if not _column_exists(db, "consumption_records", "billing_date"):
+        _execute(db, "ALTER TABLE consumption_records ADD COLUMN billing_date DATE NULL AFTER consumer_id")
+        _execute(db, "UPDATE consumption_records SET billing_date = DATE(timestamp) WHERE billing_date IS NULL")
+
+
+def _duplicate_keys(db, table, columns, sample=5):
+    """(duplicate key count, sample rows of (key..., copies)) for the non-NULL values of columns."""
+    not_null = " AND ".join(f"{column.strip()} IS NOT NULL" for column in columns.split(","))
+    rows = _execute(db, f"""
+        SELECT {columns}, COUNT(*) FROM {table} WHERE {not_null}
+        GROUP BY {columns} HAVING COUNT(*) > 1
+    """, fetch=True)
+    return len(rows), rows[:sample]
+
+
+def _hot_indexes(db):
+    """
+    Add the INDEXES. Duplicates blocking a unique key are reported, not deleted: on
+    consumption_records they are double deductions that need a refund decision, so
+    the migration stops until they are resolved and `upgrade` is rerun.
+    """
+    conflicts = []
+    for table, index, columns, unique in INDEXES:
+        if unique and not _index_exists(db, table, index):
+            count, sample = _duplicate_keys(db, table, columns)
+            if count:
+                conflicts.append(f"  {table} ({columns}): {count} duplicated key(s), e.g. {sample}")
+    if conflicts:
+        raise RuntimeError("Duplicate rows block unique indexes; resolve them and rerun upgrade:\n"
+                           + "\n".join(conflicts))
+
+    for table, index, columns, unique in INDEXES:
+        if not _index_exists(db, table, index):
+            print(f"  + {table}.{index} ({columns})")
+            _execute(db, f"ALTER TABLE {table} ADD {'UNIQUE ' if unique else ''}KEY {index} ({columns})")
+
+
+def _monthly_partitions(db):
+    """
+    Range-partition consumption_records (billing_date) and meter_readings (reading_datetime)
+    by month, and add the meter_readings_daily rollup that outlives archived raw readings.
+    MySQL requires the partition column in every unique key, so it joins the primary keys.
+    """
+    _execute(db, """
+        CREATE TABLE IF NOT EXISTS meter_readings_daily (
+            meter_id VARCHAR(50), reading_date DATE, open_kwh DOUBLE, close_kwh DOUBLE, reading_count INT,
+            first_reading_at DATETIME, last_reading_at DATETIME, PRIMARY KEY (meter_id, reading_date))
+    """)
+    primary_keys = {
+        "consumption_records": "MODIFY billing_date DATE NOT NULL",
+        "meter_readings": "MODIFY reading_datetime DATETIME NOT NULL",
+    }
+    pending = {table: column for table, column in PARTITION_KEYS.items() if not db.get_partitions(table)}
+    # MODIFY ... NOT NULL fails on legacy NULL rows; report them all before any DDL runs
+    nulls = []
+    for table, column in pending.items():
+        count = _execute(db, f"SELECT COUNT(*) FROM {table} WHERE {column} IS NULL", fetch=True)[0][0]
+        if count:
+            nulls.append(f"  {table}.{column}: {count} row(s) are NULL")
+    if nulls:
+        raise RuntimeError("Rows without a partition key block partitioning; set or remove them and rerun upgrade:\n"
+                           + "\n".join(nulls))
+
+    for table, column in pending.items():
+        _execute(db, f"ALTER TABLE {table} {primary_keys[table]}, DROP PRIMARY KEY, ADD PRIMARY KEY (id, {column})")
+        db.partition_by_month(table)
+
+
+def _meter_reading_dedupe_key(db):
+    """
+    Make (meter_id, reading_datetime) unique so re-pushed readings are ignored:
+    drop existing duplicates (keeping the first stored row), then swap the plain index for a unique one.
+    """
+    if _index_exists(db, "meter_readings", "uq_meter_readings_meter_datetime"):
+        return
+    _execute(db, """
+        DELETE newer FROM meter_readings newer
+        INNER JOIN meter_readings older
+            ON older.meter_id = newer.meter_id AND older.reading_datetime = newer.reading_datetime
+           AND older.id < newer.id
+    """)
+    drop_plain = ("DROP KEY idx_meter_readings_meter_datetime, "
+                  if _index_exists(db, "meter_readings", "idx_meter_readings_meter_datetime") else "")
+    _execute(db, f"""
+        ALTER TABLE meter_readings {drop_plain}
+        ADD UNIQUE KEY uq_meter_readings_meter_datetime (meter_id, reading_datetime)
+    """)
+
+
+def _recharge_transaction_ref_key(db):
+    """
+    Make recharges.transaction_ref unique so a retried payment callback replays
+    instead of crediting twice. Earlier duplicates were all credited, so they are
+    kept and only their reference is suffixed with '#<id>' before the key is added.
+    """
+    if _index_exists(db, "recharges", "uq_recharges_transaction_ref"):
+        return
+    _execute(db, """
+        UPDATE recharges newer
+        INNER JOIN recharges older ON older.transaction_ref = newer.transaction_ref AND older.id < newer.id
+        SET newer.transaction_ref = CONCAT(LEFT(newer.transaction_ref, 80), '#', newer.id)
+    """)
+    _execute(db, "ALTER TABLE recharges ADD UNIQUE KEY uq_recharges_transaction_ref (transaction_ref)")
+
+
+MIGRATIONS = [
+    (1, "base_schema", _base_schema),
+    (2, "billing_idempotency_key", _billing_idempotency_key),
+    (3, "hot_indexes", _hot_indexes),
+    (4, "monthly_partitions", _monthly_partitions),
+    (5, "meter_reading_dedupe_key", _meter_reading_dedupe_key),
+    (6, "recharge_transaction_ref_key", _recharge_transaction_ref_key),
+]
+
+
+def applied_versions(db):
+    _execute(db, """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY, name VARCHAR(100), applied_at DATETIME)
+    """)
+    return {row[0] for row in _execute(db, "SELECT version FROM schema_migrations", fetch=True)}
+
+
+def upgrade(db=None):
+    """Apply every pending migration in order; returns the versions applied."""
+    db = db or DatabaseManager()
+    done = applied_versions(db)
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"🔧 Applying migration {version:03d} {name}")
+        migrate(db)
+        _execute(db, "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, NOW())",
+                 (version, name))
+        applied.append(version)
+    print(f"✅ Schema up to date ({len(applied)} migration(s) applied)")
+    return applied
+
+
+# -----------------------------
+# Hot Query Check
+# -----------------------------
+def hot_queries():
+    """
+    (name, query, params, expected_scans) for the statements the application runs
+    most, with representative parameters. expected_scans lists the tables a query
+    reads in full by design (e.g. the consumer base driving the billing anti-join).
+    """
+    today = datetime.date.today()
+    month_start = today.replace(day=1)
+    return [
+        ("consumption_history", """
+            SELECT timestamp, kwh_used, total_deduction, balance_after, id FROM consumption_records
+            WHERE consumer_id = %s ORDER BY timestamp DESC, id DESC LIMIT 51
+        """, ("C0000001",), ()),
+        ("unbilled_consumers", """
+            SELECT c.consumer_id FROM consumers c
+            LEFT JOIN consumption_records r ON r.consumer_id = c.consumer_id AND r.billing_date = %s
+            WHERE r.consumer_id IS NULL
+        """, (today,), ("c",)),
+        ("monthly_invoice_totals", """
+            SELECT consumer_id, SUM(total_deduction) FROM consumption_records
+            WHERE billing_date >= %s AND billing_date < %s GROUP BY consumer_id
+        """, (month_start, today + datetime.timedelta(days=1)), ()),
+        ("meter_readings_window", """
+            SELECT meter_id, reading_datetime, kwh FROM meter_readings
+            WHERE reading_datetime >= %s AND reading_datetime < %s
+        """, (today - datetime.timedelta(days=1), today), ()),
+        ("meter_reading_history", """
+            SELECT reading_datetime, kwh FROM meter_readings
+            WHERE meter_id = %s AND reading_datetime >= %s ORDER BY reading_datetime
+        """, ("M0000001", month_start), ()),
+        ("pending_invoices", """
+            SELECT invoice_id, consumer_id, total_amount FROM invoices WHERE sync_status = 'Pending'
+        """, (), ()),
+        ("pending_verifications", """
+            SELECT reference_number, created_at, id FROM nsc_applications
+            WHERE status = 'Pending' ORDER BY created_at, id LIMIT 51
+        """, (), ()),
+        ("my_applications", """
+            SELECT reference_number, created_at, id FROM nsc_applications ORDER BY created_at DESC, id DESC LIMIT 51
+        """, (), ()),
+        ("application_by_ref", "SELECT * FROM nsc_applications WHERE reference_number = %s", ("NSC-000000",), ()),
+        ("pending_meter_commands", "SELECT id, meter_id FROM meter_commands WHERE status = 'PENDING'", (), ()),
+        ("vendor_by_api_key", """
+            SELECT vendor_id FROM vendor_api_keys WHERE api_key_hash = %s AND is_active = 1
+        """, ("0" * 64,), ()),
+        ("recharge_replay", """
+            SELECT r.consumer_id, r.amount, c.balance
+            FROM recharges r LEFT JOIN consumers c ON c.consumer_id = r.consumer_id
+            WHERE r.transaction_ref = %s
+        """, ("TXN-000000",), ()),
+    ]
+
+
+def check(db=None):
+    """
+    EXPLAIN every hot query and report plan rows that scan a whole table
+    (type ALL, or index without a usable key); the partitions each plan touches are
+    listed so missing pruning shows up too. Plans depend on table statistics,
+    so run this against a database with representative data. Returns the names
+    of queries with full scans.
+    """
+    db = db or DatabaseManager()
+    scans = []
+    queries = hot_queries()
+    for name, query, params, expected_scans in queries:
+        conn = db.pool.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("EXPLAIN " + query, params)
+            plan = cursor.fetchall()
+        except Exception as e:
+            print(f"⚠️ {name}: EXPLAIN failed: {e}")
+            continue
+        finally:
+            cursor.close()
+            conn.close()
+
+        full = [
+            row for row in plan
+            if row.get("table") not in expected_scans
+            and (row.get("type") == "ALL" or (row.get("type") == "index" and not row.get("key")))
+        ]
+        if full:
+            scans.append(name)
+            for row in full:
+                print(f"❌ {name}: full scan of {row['table']} (~{row.get('rows')} rows, "
+                      f"possible keys: {row.get('possible_keys') or 'none'})")
+        else:
+            keys = ", ".join(
+                f"{row['table']}:{row.get('key')}" + (f" [{row['partitions']}]" if row.get("partitions") else "")
+                for row in plan if row.get("table")
+            )
+            print(f"✅ {name}: {keys}")
+    print(f"{'❌' if scans else '✅'} {len(scans)} of {len(queries)} hot queries scan a full table")
+    return scans
+
+
+def status(db=None):
+    db = db or DatabaseManager()
+    done = applied_versions(db)
+    for version, name, _ in MIGRATIONS:
+        print(f"{'✅' if version in done else '⏳'} {version:03d} {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("upgrade", help="Apply pending migrations")
+    commands.add_parser("status", help="List applied and pending migrations")
+    commands.add_parser("check", help="Report full table scans in the hot queries (exit 1 if any)")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        upgrade()
+    elif args.command == "status":
+        status()
+    elif args.command == "check":
+        sys.exit(1 if check() else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 # nsc_app/api.py
-from flask import Blueprint, jsonify, request
-from .nsc_database import NSCDatabase
+import os
+from flask import Blueprint, Response, jsonify, request
+from database_manager import HIERARCHY_INDEX
+from .nsc_database import APPLICATION_LIST_COLUMNS, PENDING_VERIFICATION_COLUMNS, NSCDatabase
+
+LOCATIONS_MAX_AGE = int(os.getenv("LOCATIONS_MAX_AGE", "300"))  # Seconds browsers may reuse /locations unrevalidated
 
 api_blueprint = Blueprint("nsc_api", __name__)
 db = NSCDatabase()
@@ -9,16 +13,29 @@ db = NSCDatabase()
 
 @api_blueprint.route('/locations', methods=['GET'])
 def get_locations():
+    """Pre-serialized hierarchy JSON from the in-memory index; If-None-Match revalidations get a 304."""
     try:
-        rows = db.get_location_hierarchy()
-        hierarchy = {}
-        for circle, division, subdivision, section in rows:
-            hierarchy.setdefault(circle, {}).setdefault(division, {}).setdefault(subdivision, []).append(section)
-        return jsonify(hierarchy)
+        index = db.get_location_index()
+        response = Response(index.locations_json, mimetype="application/json")
+        response.set_etag(index.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = LOCATIONS_MAX_AGE
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@api_blueprint.route('/locations/refresh', methods=['POST'])
+def refresh_locations():
+    """Rebuild the hierarchy index now (after editing Circles/Divisions/Subdivisions/Sections)."""
+    try:
+        HIERARCHY_INDEX.invalidate()
+        db.get_location_index()
+        return jsonify({"success": True, **HIERARCHY_INDEX.stats()})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
 @api_blueprint.route('/submit-nsc', methods=['POST'])
 def submit_nsc():
     try:
@@ -46,17 +63,25 @@ def submit_nsc():
 
 # ✅ New APIs ---------------------------------------
 
+def _page_response(fetch_page, columns):
+    """Serve one keyset page: ?limit= (capped) and ?cursor= from the previous page's next_cursor."""
+    try:
+        rows, next_cursor = fetch_page(limit=request.args.get('limit', type=int), cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if rows is None:
+        return jsonify({"error": "Could not load applications"}), 500
+    return jsonify({"items": [dict(zip(columns, row)) for row in rows], "next_cursor": next_cursor})
+
 # Get applications for logged-in user (mock for now)
 @api_blueprint.route('/my-applications', methods=['GET'])
 def my_applications():
-    apps = db.get_user_applications()
-    return jsonify(apps)
+    return _page_response(db.get_user_applications, APPLICATION_LIST_COLUMNS)
 
-# Get all pending verifications
+# Get pending verifications, one page at a time
 @api_blueprint.route('/pending-verifications', methods=['GET'])
 def pending_verifications():
-    pending = db.get_pending_verifications()
-    return jsonify(pending)
+    return _page_response(db.get_pending_verifications, PENDING_VERIFICATION_COLUMNS)
 
 # Get full details for one application
 @api_blueprint.route('/application/<ref_no>', methods=['GET'])
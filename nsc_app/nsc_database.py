@@ -1,7 +1,12 @@
-from database_manager import DatabaseManager
+from database_manager import DatabaseManager, PAGE_SIZE, page_size
 import random
 import string
 
+APPLICATION_LIST_COLUMNS = ("reference_number", "name", "category", "status", "meter_number", "account_number",
+                            "created_at", "id")
+PENDING_VERIFICATION_COLUMNS = ("reference_number", "name", "phone", "address", "category", "circle", "division",
+                                "subdivision", "section", "status", "created_at", "id")
+
 class NSCDatabase(DatabaseManager):
     """Handles all NSC-specific database operations."""
 
@@ -23,33 +28,40 @@ class NSCDatabase(DatabaseManager):
             return None
 
     def get_location_hierarchy(self):
-        """Fetch Circle → Division → Subdivision → Section mapping."""
-        query = """
-            SELECT c.CircleName, d.DivisionName, s.SubdivisionName, sec.SectionName
-            FROM Circles c
-            INNER JOIN Divisions d ON c.CircleID = d.CircleID
-            INNER JOIN Subdivisions s ON d.DivisionID = s.DivisionID
-            INNER JOIN Sections sec ON s.SubdivisionID = sec.SubdivisionID
-        """
-        return self._run_query(query, fetch=True)
+        """Circle → Division → Subdivision → Section name mapping, served from the in-memory hierarchy index."""
+        return [(row[1], row[3], row[5], row[7]) for row in self.get_full_hierarchy()]
 
     # -------------------------------------------------------------------
     # 👇 New Methods for Inspection → AMISP → Profile Creation Workflow
     # -------------------------------------------------------------------
 
-    def get_user_applications(self):
-        """Fetch all NSC applications for the logged-in user (mock for now)."""
-        query = "SELECT reference_number, name, category, status FROM nsc_applications ORDER BY created_at DESC"
-        return self._run_query(query, fetch=True)
+    def get_user_applications(self, limit=PAGE_SIZE, cursor=None):
+        """
+        One page of NSC applications for the logged-in user (mock for now), newest first,
+        keyed on (created_at, id). Rows follow APPLICATION_LIST_COLUMNS; returns (rows, next_cursor).
+        """
+        keyset, keyset_params = self._keyset_filter("created_at", cursor)
+        query = f"""
+            SELECT {', '.join(APPLICATION_LIST_COLUMNS)}
+            FROM nsc_applications
+            WHERE 1 = 1 {keyset}
+            ORDER BY created_at DESC, id DESC
+        """
+        return self._keyset_page(query, keyset_params, page_size(limit), key=lambda row: (row[-2], row[-1]))
 
-    def get_pending_verifications(self):
-        """Return all applications pending site inspection verification."""
-        query = """
-            SELECT reference_number, name, phone, address, category, circle, division, subdivision, section, status
+    def get_pending_verifications(self, limit=PAGE_SIZE, cursor=None):
+        """
+        One page of applications pending site inspection verification, oldest first,
+        keyed on (created_at, id). Rows follow PENDING_VERIFICATION_COLUMNS; returns (rows, next_cursor).
+        """
+        keyset, keyset_params = self._keyset_filter("created_at", cursor, descending=False)
+        query = f"""
+            SELECT {', '.join(PENDING_VERIFICATION_COLUMNS)}
             FROM nsc_applications
-            WHERE status = 'Pending'
+            WHERE status = 'Pending' {keyset}
+            ORDER BY created_at, id
         """
-        return self._run_query(query, fetch=True)
+        return self._keyset_page(query, keyset_params, page_size(limit), key=lambda row: (row[-2], row[-1]))
 
     def get_application_by_ref(self, ref_number):
         """Fetch detailed info for a specific application."""
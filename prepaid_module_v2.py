@@ -1,13 +1,18 @@
 # prepaid_module_v2.py - Prepaid Module Logic
 
+from array import array
 from datetime import datetime
-from typing import List
+from decimal import ROUND_HALF_UP, Decimal
 
 # -----------------------------
 # Data Models
 # -----------------------------
 class ConsumptionRecord:
-    def __init__(self, timestamp, kwh_consumed, subsidy_units=0, energy_charge=0, fixed_charge=0, total_deduction=0, balance_before=0, balance_after=0):
+    __slots__ = ("consumer_id", "timestamp", "kwh_consumed", "subsidy_units", "energy_charge", "fixed_charge",
+                 "total_deduction", "balance_before", "balance_after")
+
+    def __init__(self, timestamp, kwh_consumed, subsidy_units=0, energy_charge=0, fixed_charge=0, total_deduction=0, balance_before=0, balance_after=0, consumer_id=None):
+        self.consumer_id = consumer_id
         self.timestamp = timestamp
         self.kwh_consumed = kwh_consumed
         self.subsidy_units = subsidy_units
@@ -18,6 +23,8 @@ class ConsumptionRecord:
         self.balance_after = balance_after
 
 class RechargeTransaction:
+    __slots__ = ("amount", "timestamp", "voucher_code", "status")
+
     def __init__(self, amount, timestamp=None, voucher_code=None, status="SUCCESS"):
         self.amount = amount
         self.timestamp = timestamp or datetime.now()
@@ -25,15 +32,88 @@ class RechargeTransaction:
         self.status = status
 
 class Alert:
+    __slots__ = ("timestamp", "alert_type", "message")
+
     def __init__(self, timestamp, alert_type, message):
         self.timestamp = timestamp
         self.alert_type = alert_type
         self.message = message
 
+class ConsumerRow:
+    """
+    Compact consumer row streamed from the database for batch jobs.
+    Slotted, with no history lists or BillingLogic attached.
+    """
+    __slots__ = ("consumer_id", "name", "address", "phone", "balance", "status", "plan_id")
+
+    def __init__(self, consumer_id, name, address, phone, balance=0.0, status="ACTIVE", plan_id=None):
+        self.consumer_id = consumer_id
+        self.name = name
+        self.address = address
+        self.phone = phone
+        self.balance = balance
+        self.status = status
+        self.plan_id = plan_id
+
+class ConsumptionHistory:
+    """
+    Columnar, array-backed store for one consumer's ConsumptionRecord history.
+    Each field is a packed 8-byte array (timestamps as POSIX seconds), so a record
+    costs 72 bytes instead of a full object; records are rebuilt on access.
+    Money fields are kept exact as integer ten-thousandths, the DECIMAL(14,4) scale
+    of consumption_records, and come back as Decimal.
+    """
+    __slots__ = ("consumer_id", "_timestamps", "_columns")
+
+    FIELDS = ("kwh_consumed", "subsidy_units", "energy_charge", "fixed_charge",
+              "total_deduction", "balance_before", "balance_after")
+    MONEY_FIELDS = ("energy_charge", "fixed_charge", "total_deduction", "balance_before", "balance_after")
+    MONEY_PLACES = 4
+
+    def __init__(self, consumer_id=None, records=()):
+        self.consumer_id = consumer_id
+        self._timestamps = array("d")
+        self._columns = tuple(array("q" if field in self.MONEY_FIELDS else "d") for field in self.FIELDS)
+        for record in records:
+            self.append(record)
+
+    def append(self, record):
+        self._timestamps.append(record.timestamp.timestamp())
+        for column, field in zip(self._columns, self.FIELDS):
+            value = getattr(record, field)
+            if column.typecode == "q":
+                column.append(int(Decimal(str(value)).scaleb(self.MONEY_PLACES).to_integral_value(ROUND_HALF_UP)))
+            else:
+                column.append(float(value))
+
+    def column(self, field):
+        """Return one field as a packed array, e.g. for sums or NumPy views (money in ten-thousandths)."""
+        return self._columns[self.FIELDS.index(field)]
+
+    def clear(self):
+        del self._timestamps[:]
+        for column in self._columns:
+            del column[:]
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __getitem__(self, index):
+        values = [Decimal(column[index]).scaleb(-self.MONEY_PLACES) if column.typecode == "q" else column[index]
+                  for column in self._columns]
+        return ConsumptionRecord(datetime.fromtimestamp(self._timestamps[index]), *values,
+                                 consumer_id=self.consumer_id)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
 # -----------------------------
 # Tariff Plan
 # -----------------------------
 class TariffPlan:
+    __slots__ = ("plan_id", "rate_per_kwh", "fixed_charge_daily", "low_balance_threshold", "subsidy_units", "subsidy_rate")
+
     def __init__(self, plan_id, rate_per_kwh, fixed_charge_daily=0.0, low_balance_threshold=50.0, subsidy_units=0, subsidy_rate=0.0):
         self.plan_id = plan_id
         self.rate_per_kwh = rate_per_kwh
@@ -49,6 +129,8 @@ class BillingLogic:
     """
     Handles all billing calculations: consumption, subsidy, fixed charge, total deduction.
     """
+    __slots__ = ("consumer",)
+
     def __init__(self, consumer):
         self.consumer = consumer
 
@@ -104,18 +186,65 @@ class BillingLogic:
 class Consumer:
     """
     Represents a consumer. Holds details and allows attribute updates.
+    History, recharges, alerts and the BillingLogic helper are created on first use.
     """
-    def __init__(self, consumer_id, name, address, phone, balance=0.0, status="ACTIVE"):
+    __slots__ = ("consumer_id", "name", "address", "phone", "balance", "status", "plan_id",
+                 "_consumption_records", "_recharges", "_alerts", "_billing")
+
+    def __init__(self, consumer_id, name, address, phone, balance=0.0, status="ACTIVE", plan_id=None):
         self.consumer_id = consumer_id
         self.name = name
         self.address = address
         self.phone = phone
         self.balance = balance
         self.status = status
-        self.consumption_records: List[ConsumptionRecord] = []
-        self.recharges: List[RechargeTransaction] = []
-        self.alerts: List[Alert] = []
-        self.billing = BillingLogic(self)  # Link billing logic
+        self.plan_id = plan_id
+        self._consumption_records = None
+        self._recharges = None
+        self._alerts = None
+        self._billing = None
+
+    @property
+    def consumption_records(self):
+        if self._consumption_records is None:
+            self._consumption_records = ConsumptionHistory(self.consumer_id)
+        return self._consumption_records
+
+    @consumption_records.setter
+    def consumption_records(self, records):
+        if not isinstance(records, ConsumptionHistory):
+            records = ConsumptionHistory(self.consumer_id, records)
+        self._consumption_records = records
+
+    @property
+    def recharges(self):
+        if self._recharges is None:
+            self._recharges = []
+        return self._recharges
+
+    @recharges.setter
+    def recharges(self, recharges):
+        self._recharges = list(recharges)
+
+    @property
+    def alerts(self):
+        if self._alerts is None:
+            self._alerts = []
+        return self._alerts
+
+    @alerts.setter
+    def alerts(self, alerts):
+        self._alerts = list(alerts)
+
+    @property
+    def billing(self):
+        if self._billing is None:
+            self._billing = BillingLogic(self)  # Link billing logic
+        return self._billing
+
+    @billing.setter
+    def billing(self, billing):
+        self._billing = billing
 
     def update_attribute(self, attr, value):
         if hasattr(self, attr):
@@ -125,9 +254,11 @@ class Consumer:
             print(f"Attribute '{attr}' not found for Consumer {self.consumer_id}")
 
     def send_alerts(self):
-        for alert in self.alerts:
+        if not self._alerts:
+            return
+        for alert in self._alerts:
             print(f"[ALERT] {alert.timestamp} - {alert.message}")
-        self.alerts.clear()
+        self._alerts.clear()
 
     def generate_daily_billing_sheet(self):
         print(f"\n=== Daily Billing Sheet for Consumer {self.consumer_id} - {self.name} ===")
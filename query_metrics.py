@@ -0,0 +1,237 @@
+# query_metrics.py - Per-statement timing, slow-query log and query histograms
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+logger = logging.getLogger("db.slow")
+
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))                 # Statements slower than this are logged
+EXPLAIN_SLOW_QUERIES = os.getenv("DB_EXPLAIN_SLOW_QUERIES", "0") == "1"     # Capture EXPLAIN for slow statements
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+# Frames that only plumb a statement through to the driver; the caller reported is the first frame outside them
+PLUMBING = {"_run_query", "_stream_query", "_bulk_insert", "_bulk_update", "_execute", "transaction"}
+_SKIP_FILES = (__file__, "contextlib.py")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "REPLACE", "UPDATE", "DELETE")
+
+_WHITESPACE = re.compile(r"\s+")
+_VALUE_LISTS = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)(?:\s*,\s*\(\s*%s(?:\s*,\s*%s)*\s*\))*")
+_UNION_ROWS = re.compile(r"(?: UNION ALL SELECT %s(?:, %s)*)+")
+
+
+def normalize_query(query):
+    """
+    Collapse whitespace and variable-length placeholder lists (multi-row VALUES,
+    IN (...), UNION ALL row sets) so every chunk size of a statement shares one key.
+    """
+    query = _WHITESPACE.sub(" ", query).strip()
+    query = _VALUE_LISTS.sub("(...)", query)
+    return _UNION_ROWS.sub(" UNION ALL SELECT ...", query)
+
+
+def calling_method():
+    """Qualified name of the first frame outside the query plumbing, e.g. 'NSCDatabase.get_user_applications'."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name not in PLUMBING and not code.co_filename.endswith(_SKIP_FILES):
+            return getattr(code, "co_qualname", code.co_name)
+        frame = frame.f_back
+    return "?"
+
+
+class QueryStats:
+    __slots__ = ("query", "count", "errors", "rows", "total_seconds", "max_seconds", "buckets", "callers", "explain")
+
+    def __init__(self, query):
+        self.query = query
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.callers = {}
+        self.explain = None
+
+    def as_dict(self):
+        return {
+            "query": self.query,
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "avg_ms": round(self.total_seconds * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "histogram_ms": {f"le_{bound}": n for bound, n in zip(LATENCY_BUCKETS_MS, self.buckets)},
+            "callers": dict(self.callers),
+            "explain": self.explain,
+        }
+
+
+class QueryMetrics:
+    """
+    In-process registry of statement timings keyed by normalized query text:
+    call count, rows, errors, latency histogram and calling methods per query.
+    """
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, explain_slow=EXPLAIN_SLOW_QUERIES):
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow = explain_slow
+        self.slow_queries = 0
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, query, caller, seconds, rows, error=False):
+        """Add one statement execution; returns True when it crossed the slow-query threshold."""
+        key = normalize_query(query)
+        ms = seconds * 1000
+        bucket = next(i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound)
+        slow = ms >= self.slow_query_ms
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats(key)
+            stats.count += 1
+            stats.errors += error
+            stats.rows += max(rows, 0)
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[bucket] += 1
+            stats.callers[caller] = stats.callers.get(caller, 0) + 1
+            self.slow_queries += slow
+        if slow:
+            logger.warning(json.dumps({
+                "event": "slow_query", "caller": caller, "ms": round(ms, 3), "rows": rows,
+                "error": error, "query": key,
+            }))
+        return slow
+
+    def wants_explain(self, query):
+        """EXPLAIN is captured once per normalized query, and only when enabled."""
+        if not self.explain_slow or not query.lstrip().upper().startswith(_EXPLAINABLE):
+            return False
+        stats = self._stats.get(normalize_query(query))
+        return stats is not None and stats.explain is None
+
+    def record_explain(self, query, plan):
+        key = normalize_query(query)
+        with self._lock:
+            if key in self._stats:
+                self._stats[key].explain = plan
+        logger.warning(json.dumps({"event": "slow_query_explain", "query": key, "plan": plan}, default=str))
+
+    def top(self, limit=10):
+        """The `limit` statements with the most total time, slowest first."""
+        with self._lock:
+            ordered = sorted(self._stats.values(), key=lambda stats: stats.total_seconds, reverse=True)
+            return [stats.as_dict() for stats in ordered[:limit]]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "slow_query_ms": self.slow_query_ms,
+                "slow_queries": self.slow_queries,
+                "statements": sum(stats.count for stats in self._stats.values()),
+                "distinct_queries": len(self._stats),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_queries = 0
+
+
+QUERY_METRICS = QueryMetrics()
+
+
+class InstrumentedCursor:
+    """
+    Cursor proxy that times every statement, including the fetches that drain its
+    (unbuffered) result, and reports it to QUERY_METRICS once the next statement
+    runs or the cursor is closed.
+    """
+    __slots__ = ("_cursor", "_conn", "_metrics", "_query", "_params", "_caller", "_seconds", "_rows", "_error")
+
+    def __init__(self, cursor, conn, metrics=QUERY_METRICS):
+        self._cursor = cursor
+        self._conn = conn
+        self._metrics = metrics
+        self._query = None
+
+    def execute(self, query, params=()):
+        self._flush()
+        self._query = query
+        self._params = params
+        self._caller = calling_method()
+        self._rows = 0
+        self._error = False
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(query, params)
+        except Exception:
+            self._error = True
+            raise
+        finally:
+            self._seconds = time.perf_counter() - start
+            if self._cursor.rowcount > 0:
+                self._rows = self._cursor.rowcount
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._seconds += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self._timed_fetch(self._cursor.fetchone)
+        self._rows = max(self._rows, self._cursor.rowcount)
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._timed_fetch(self._cursor.fetchmany, size)
+        self._rows = max(self._rows, self._cursor.rowcount)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(self._cursor.fetchall)
+        self._rows = max(self._rows, self._cursor.rowcount, len(rows))
+        return rows
+
+    def close(self):
+        self._flush()
+        return self._cursor.close()
+
+    def _flush(self):
+        if self._query is None:
+            return
+        query, params = self._query, self._params
+        self._query = None
+        slow = self._metrics.record(query, self._caller, self._seconds, self._rows, self._error)
+        if slow and not self._error and self._metrics.wants_explain(query):
+            self._explain(query, params)
+
+    def _explain(self, query, params):
+        # Needs the connection free of unread rows; skip rather than disturb the caller
+        if self._conn.unread_result:
+            return
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("EXPLAIN " + query, params)
+            columns = [column[0] for column in cursor.description]
+            self._metrics.record_explain(query, [dict(zip(columns, row)) for row in cursor.fetchall()])
+        except Exception as e:
+            print(f"⚠️ EXPLAIN failed: {e}")
+        finally:
+            cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
@@ -0,0 +1,147 @@
+# reading_ingest.py - Incremental NDJSON/CSV meter reading ingestion
+#
+# The request body is consumed chunk by chunk: complete lines are parsed as they
+# arrive and written in batches of READING_STREAM_BATCH_SIZE, so memory stays
+# bounded by one batch regardless of how many readings a vendor streams.
+#
+#   NDJSON: {"meter_id": "M1", "reading_datetime": "2025-01-31T23:45:00", "kwh": 1234.5}
+#   CSV:    header line naming meter_id, reading_datetime, kwh; one reading per line
+import csv
+import datetime
+import json
+import math
+import os
+
+READING_STREAM_BATCH_SIZE = int(os.getenv("READING_STREAM_BATCH_SIZE", "1000"))
+MAX_LINE_BYTES = 64 * 1024           # Longer lines are rejected without being buffered
+MAX_REJECTION_SAMPLES = 20           # Rejection reasons reported back to the vendor
+CSV_FIELDS = ("meter_id", "reading_datetime", "kwh")
+
+
+async def iter_lines(chunks):
+    """
+    Yield complete lines (bytes, without the newline) from an async iterator of body
+    chunks. A line over MAX_LINE_BYTES is yielded as None; one still streaming is
+    discarded as it arrives rather than buffered.
+    """
+    buffer = b""
+    skipping = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                # Tail of an overlong line
+                skipping = False
+                continue
+            yield line if len(line) <= MAX_LINE_BYTES else None
+        if len(buffer) > MAX_LINE_BYTES:
+            if not skipping:
+                yield None
+                skipping = True
+            buffer = b""
+    if buffer and not skipping:
+        yield buffer
+
+
+def make_reading(meter_id, reading_datetime, kwh):
+    """Validate one reading into a (meter_id, reading_datetime, kwh) row; raises ValueError."""
+    meter_id = str(meter_id or "").strip()
+    if not meter_id or len(meter_id) > 50:
+        raise ValueError("meter_id must be 1-50 characters")
+    if not isinstance(reading_datetime, datetime.datetime):
+        reading_datetime = datetime.datetime.fromisoformat(str(reading_datetime).strip())
+    if reading_datetime.tzinfo is not None:
+        # Stored as naive server-local time, like every other timestamp
+        reading_datetime = reading_datetime.astimezone().replace(tzinfo=None)
+    kwh = float(kwh)
+    if not math.isfinite(kwh) or kwh < 0:
+        raise ValueError("kwh must be a non-negative number")
+    return meter_id, reading_datetime, kwh
+
+
+def parse_ndjson(text):
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    return make_reading(data.get("meter_id"), data.get("reading_datetime"), data.get("kwh"))
+
+
+def parse_csv_header(text):
+    """Column positions of CSV_FIELDS in the header line; raises ValueError if any is missing."""
+    names = [name.strip().lower() for name in next(csv.reader([text]))]
+    missing = [field for field in CSV_FIELDS if field not in names]
+    if missing:
+        raise ValueError(f"CSV header is missing column(s): {', '.join(missing)}")
+    return [names.index(field) for field in CSV_FIELDS]
+
+
+def parse_csv(text, positions):
+    values = next(csv.reader([text]))
+    return make_reading(*(values[position] for position in positions))
+
+
+async def ingest_reading_stream(db, chunks, fmt="ndjson", batch_size=READING_STREAM_BATCH_SIZE):
+    """
+    Parse and write a streamed body of readings batch by batch.
+
+    Returns a summary with one entry per written batch (accepted / duplicates /
+    rejected lines since the previous batch), totals and a sample of rejection
+    reasons. If a batch write fails, the summary so far is returned with "error" set;
+    batches before it are committed and a resend skips them as duplicates.
+    Raises ValueError if a CSV body has no usable header.
+    """
+    summary = {"batches": [], "accepted": 0, "duplicates": 0, "rejected": 0, "rejections": []}
+    batch = []
+    rejected = 0
+    positions = None
+    line_number = 0
+
+    async def flush():
+        nonlocal batch, rejected
+        accepted, duplicates = await db.insert_meter_readings(batch, chunk_size=max(len(batch), 1))
+        summary["batches"].append({
+            "batch": len(summary["batches"]) + 1, "accepted": accepted, "duplicates": duplicates, "rejected": rejected,
+        })
+        summary["accepted"] += accepted
+        summary["duplicates"] += duplicates
+        batch, rejected = [], 0
+
+    lines = iter_lines(chunks)
+    if fmt == "csv":
+        async for line in lines:
+            line_number += 1
+            if line is None:
+                raise ValueError("CSV header line is too long")
+            if line.strip():
+                positions = parse_csv_header(line.decode("utf-8", "replace").strip())
+                break
+        else:
+            raise ValueError("CSV body has no header line")
+
+    try:
+        async for line in lines:
+            line_number += 1
+            try:
+                if line is None:
+                    raise ValueError(f"line longer than {MAX_LINE_BYTES} bytes")
+                text = line.decode("utf-8").strip()
+                if not text:
+                    continue
+                reading = parse_csv(text, positions) if fmt == "csv" else parse_ndjson(text)
+            except (ValueError, TypeError, IndexError) as e:
+                rejected += 1
+                summary["rejected"] += 1
+                if len(summary["rejections"]) < MAX_REJECTION_SAMPLES:
+                    summary["rejections"].append({"line": line_number, "reason": str(e)})
+                continue
+
+            batch.append(reading)
+            if len(batch) >= batch_size:
+                await flush()
+
+        if batch or rejected:
+            await flush()
+    except Exception as e:
+        summary["error"] = f"Batch {len(summary['batches']) + 1} failed: {e}"
+    return summary
@@ -0,0 +1,49 @@
+# rms_stub_server.py - Local stand-in for the RMS/MDM invoice API
+# Run: uvicorn rms_stub_server:app --port 8090
+# Then: RMS_URL=http://127.0.0.1:8090 and BillingEngine().sync_invoices_with_rms()
+import asyncio
+import os
+import random
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from typing import List
+
+STUB_LATENCY_MS = float(os.getenv("RMS_STUB_LATENCY_MS", "50"))       # Simulated per-request latency
+STUB_ERROR_RATE = float(os.getenv("RMS_STUB_ERROR_RATE", "0.05"))     # Share of requests answered with 503
+STUB_REJECT_RATE = float(os.getenv("RMS_STUB_REJECT_RATE", "0.01"))   # Share of invoices rejected
+
+app = FastAPI(title="RMS/MDM Stub")
+
+stats = {"requests": 0, "errors": 0, "accepted": 0, "rejected": 0}
+
+
+class InvoicePayload(BaseModel):
+    invoice_id: int
+    consumer_id: str
+    total_amount: float
+
+
+class InvoiceBatch(BaseModel):
+    invoices: List[InvoicePayload]
+
+
+@app.post("/invoices/batch")
+async def receive_invoices(batch: InvoiceBatch):
+    stats["requests"] += 1
+    await asyncio.sleep(STUB_LATENCY_MS / 1000)
+
+    if random.random() < STUB_ERROR_RATE:
+        stats["errors"] += 1
+        raise HTTPException(status_code=503, detail="RMS temporarily unavailable")
+
+    accepted, rejected = [], []
+    for invoice in batch.invoices:
+        (rejected if random.random() < STUB_REJECT_RATE else accepted).append(invoice.invoice_id)
+    stats["accepted"] += len(accepted)
+    stats["rejected"] += len(rejected)
+    return {"accepted": accepted, "rejected": rejected}
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
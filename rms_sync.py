@@ -0,0 +1,97 @@
+# rms_sync.py - Concurrent, batched invoice sync with the RMS/MDM system
+import asyncio
+import os
+import random
+import time
+import httpx
+
+RMS_URL = os.getenv("RMS_URL")  # Example: http://127.0.0.1:8090
+RMS_BATCH_SIZE = int(os.getenv("RMS_BATCH_SIZE", "200"))
+RMS_CONCURRENCY = int(os.getenv("RMS_CONCURRENCY", "8"))
+RMS_MAX_RETRIES = int(os.getenv("RMS_MAX_RETRIES", "5"))
+RMS_BACKOFF_BASE = 0.5  # Seconds; doubled on every retry
+RMS_BACKOFF_CAP = 30.0
+RMS_TIMEOUT = 10.0
+
+
+def _retryable(error):
+    """Transport failures, 429 and 5xx may succeed later; other 4xx and malformed replies will not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class RMSSync:
+    """
+    Pushes pending invoices to the RMS/MDM batch endpoint.
+
+    Invoices are sent in batches of batch_size with at most `concurrency` requests
+    in flight. Transport errors, 429 and 5xx replies are retried with exponential
+    backoff and full jitter; other 4xx and malformed replies fail the batch at once.
+    The RMS reply lists accepted and rejected invoice IDs; batches that still fail
+    after max_retries are marked Failed as a whole.
+    """
+
+    def __init__(self, base_url=RMS_URL, batch_size=RMS_BATCH_SIZE, concurrency=RMS_CONCURRENCY,
+                 max_retries=RMS_MAX_RETRIES):
+        if not base_url:
+            raise ValueError("RMS URL not configured (environment variable 'RMS_URL')")
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+    def run(self, invoices):
+        """Sync invoices synchronously; returns (synced_ids, failed_ids, seconds)."""
+        return asyncio.run(self.sync(invoices))
+
+    async def sync(self, invoices):
+        started = time.perf_counter()
+        batches = [invoices[i:i + self.batch_size] for i in range(0, len(invoices), self.batch_size)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=RMS_TIMEOUT) as client:
+            # One batch's unexpected error must not discard the outcome of the others
+            results = await asyncio.gather(*(self._push_batch(client, semaphore, batch) for batch in batches),
+                                           return_exceptions=True)
+
+        synced, failed = [], []
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                print(f"❌ RMS batch of {len(batch)} invoices failed: {result!r}")
+                failed.extend(inv[0] for inv in batch)
+                continue
+            accepted, rejected = result
+            synced.extend(accepted)
+            failed.extend(rejected)
+        return synced, failed, time.perf_counter() - started
+
+    async def _push_batch(self, client, semaphore, batch):
+        ids = [inv[0] for inv in batch]
+        payload = {
+            "invoices": [
+                {"invoice_id": invoice_id, "consumer_id": consumer_id, "total_amount": float(amount)}
+                for invoice_id, consumer_id, amount in batch
+            ]
+        }
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    response = await client.post("/invoices/batch", json=payload)
+                response.raise_for_status()
+                body = response.json()
+                if not isinstance(body, dict):
+                    raise ValueError(f"expected a JSON object, got {type(body).__name__}")
+                accepted = set(body.get("accepted", []))
+                return [i for i in ids if i in accepted], [i for i in ids if i not in accepted]
+            except (httpx.HTTPError, ValueError) as e:
+                if not _retryable(e):
+                    print(f"❌ RMS batch of {len(ids)} invoices rejected: {e}")
+                    return [], ids
+                if attempt == self.max_retries:
+                    print(f"❌ RMS batch of {len(ids)} invoices failed after {attempt + 1} attempts: {e}")
+                    return [], ids
+                # Full jitter: sleep anywhere in [0, min(cap, base * 2^attempt)]
+                await asyncio.sleep(random.uniform(0, min(RMS_BACKOFF_CAP, RMS_BACKOFF_BASE * 2 ** attempt)))
@@ -0,0 +1,47 @@
+# Smoke test for the nightly billing entry point, with a recording stand-in for BillingEngine
+import ast
+import datetime
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import daily_billing_job
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.calls = []
+
+    def run_daily_billing(self, billing_date=None):
+        self.calls.append(("run_daily_billing", billing_date))
+        return 3, 2, 1
+
+    def run_monthly_invoice(self, month=None):
+        self.calls.append(("run_monthly_invoice", month))
+
+
+def test_bills_the_day_without_invoicing_mid_month():
+    engine = RecordingEngine()
+    result = daily_billing_job.main(engine, today=datetime.date(2025, 3, 15))
+    assert result == (3, 2, 1)
+    assert engine.calls == [("run_daily_billing", datetime.date(2025, 3, 15))]
+
+
+def test_invoices_the_previous_month_on_the_first():
+    engine = RecordingEngine()
+    daily_billing_job.main(engine, today=datetime.date(2025, 1, 1))
+    assert engine.calls == [
+        ("run_daily_billing", datetime.date(2025, 1, 1)),
+        ("run_monthly_invoice", "2024-12"),
+    ]
+
+
+def test_billing_engine_has_the_methods_the_job_calls():
+    # Read from source: importing billing_engine needs numpy, pandas and a MySQL driver
+    with open(os.path.join(ROOT, "billing_engine.py")) as f:
+        tree = ast.parse(f.read())
+    engine = next(node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == "BillingEngine")
+    methods = {node.name for node in engine.body if isinstance(node, ast.FunctionDef)}
+    assert {"run_daily_billing", "run_monthly_invoice"} <= methods
@@ -1,14 +1,26 @@
 # utility_api_server.py
-from fastapi import FastAPI, HTTPException, Header, Depends, APIRouter
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Header, Depends, APIRouter, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, confloat
 from typing import List, Optional
 from datetime import datetime, date
 import uvicorn
-from database_manager import DatabaseManager  # Your existing DB manager
+from starlette.concurrency import run_in_threadpool
+from async_database_manager import AsyncDatabaseManager, async_pool_stats, close_async_pool
+from billing_engine import BillingEngine
+from database_manager import TARIFF_CACHE, VENDOR_KEY_CACHE, DatabaseManager, RechargeConflict, pool_stats
+from ingest_buffer import IngestBacklogFull, ReadingBuffer
+from query_metrics import QUERY_METRICS
+from reading_ingest import ingest_reading_stream
 
-router = APIRouter(tags=["API Operations"])
+# Write-behind queue for pushed readings: acknowledged once spooled, written to the DB in large batches
+READING_BUFFER = ReadingBuffer("utility_api", DatabaseManager().insert_meter_readings)
 
-db = DatabaseManager()
+router = APIRouter(tags=["API Operations"], on_startup=[READING_BUFFER.start],
+                   on_shutdown=[close_async_pool, READING_BUFFER.close])
+
+# Non-blocking DB layer: endpoints await the aiomysql pool instead of holding a threadpool worker
+db = AsyncDatabaseManager()
 
 # -----------------------------
 # Pydantic Models
@@ -32,15 +44,16 @@ class DailyBillingRequest(BaseModel):
 
 class RechargeRequest(BaseModel):
     consumer_id: str
-    amount: float
+    amount: confloat(gt=0)
     payment_mode: str
     transaction_ref: Optional[str]
 
 # -----------------------------
 # Helper: API Key Auth
 # -----------------------------
-def verify_vendor_api_key(x_api_key: str = Header(...)):
-    vendor = db.get_vendor_by_api_key(x_api_key)
+async def verify_vendor_api_key(x_api_key: str = Header(...)):
+    # Resolved by key hash from the shared VENDOR_KEY_CACHE; the DB is queried only on a miss
+    vendor = await db.get_vendor_by_api_key(x_api_key)
     if not vendor:
         raise HTTPException(status_code=401, detail="Invalid API Key")
     return vendor
@@ -49,8 +62,8 @@ def verify_vendor_api_key(x_api_key: str = Header(...)):
 # Consumer Info Endpoint
 # -----------------------------
 @router.get("/consumer/{consumer_id}")
-def get_consumer_info(consumer_id: str, vendor=Depends(verify_vendor_api_key)):
-    consumer = db.get_consumer_by_id(consumer_id)
+async def get_consumer_info(consumer_id: str, vendor=Depends(verify_vendor_api_key)):
+    consumer = await db.get_consumer_by_id(consumer_id)
     if not consumer:
         raise HTTPException(status_code=404, detail="Consumer not found")
     return {
@@ -60,21 +73,69 @@ def get_consumer_info(consumer_id: str, vendor=Depends(verify_vendor_api_key)):
         "status": consumer.status
     }
 
+# -----------------------------
+# Tariff Plan Endpoint
+# -----------------------------
+@router.get("/tariff/{plan_id}")
+async def get_tariff_plan(plan_id: str, vendor=Depends(verify_vendor_api_key)):
+    tariff = await db.get_tariff_plan(plan_id)  # Served from the process-wide tariff cache
+    if not tariff:
+        raise HTTPException(status_code=404, detail="Tariff plan not found")
+    return {
+        "plan_id": tariff.plan_id,
+        "rate_per_kwh": tariff.rate_per_kwh,
+        "fixed_charge_daily": tariff.fixed_charge_daily,
+        "low_balance_threshold": tariff.low_balance_threshold,
+        "subsidy_units": tariff.subsidy_units,
+        "subsidy_rate": tariff.subsidy_rate
+    }
+
 # -----------------------------
 # Push Meter Reading Endpoint
 # -----------------------------
-@router.post("/push-meter-reading")
-def push_meter_reading(payload: PushMeterReadingRequest, vendor=Depends(verify_vendor_api_key)):
-    for reading in payload.readings:
-        db.insert_meter_reading(reading.meter_id, reading.reading_datetime, reading.kwh)
-    return {"status": "success", "message": f"{len(payload.readings)} readings recorded."}
+@router.post("/push-meter-reading", status_code=202)
+async def push_meter_reading(payload: PushMeterReadingRequest, vendor=Depends(verify_vendor_api_key)):
+    # Spooled to disk and acknowledged; the flusher coalesces payloads into multi-row INSERT IGNOREs,
+    # so readings already stored for (meter_id, reading_datetime) are skipped
+    rows = [(reading.meter_id, reading.reading_datetime, reading.kwh) for reading in payload.readings]
+    try:
+        queued = await run_in_threadpool(READING_BUFFER.enqueue, rows)
+    except IngestBacklogFull as e:
+        raise HTTPException(status_code=503, detail=f"Reading ingestion is backlogged, retry later: {e}",
+                            headers={"Retry-After": "5"})
+    return {"status": "accepted", "message": f"{queued} readings queued.", "queued": queued}
+
+# -----------------------------
+# Streaming Meter Reading Ingestion
+# -----------------------------
+@router.post("/push-meter-readings/stream")
+async def push_meter_readings_stream(request: Request, format: Optional[str] = None,
+                                     vendor=Depends(verify_vendor_api_key)):
+    """
+    NDJSON or CSV body (choose with ?format= or the Content-Type), parsed and written
+    in batches as it arrives. Invalid lines are rejected and counted, not fatal.
+    A failed batch write is a 503 whose body is the summary of the batches committed
+    before it; resending the whole body is safe, committed readings are duplicates.
+    """
+    fmt = (format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")).lower()
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    try:
+        summary = await ingest_reading_stream(db, request.stream(), fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "error" in summary:
+        summary["status"] = "failed"
+        return JSONResponse(status_code=503, content=summary, headers={"Retry-After": "5"})
+    summary["status"] = "success"
+    return summary
 
 # -----------------------------
 # Issue Meter Command Endpoint
 # -----------------------------
 @router.post("/issue-meter-command")
-def issue_meter_command(payload: MeterCommandRequest, vendor=Depends(verify_vendor_api_key)):
-    command_id = db.insert_meter_command(payload.meter_id, payload.command_type)
+async def issue_meter_command(payload: MeterCommandRequest, vendor=Depends(verify_vendor_api_key)):
+    command_id = await db.insert_meter_command(payload.meter_id, payload.command_type)
     # Optional: trigger actual vendor API call asynchronously
     return {"status": "pending", "command_id": command_id}
 
@@ -82,8 +143,8 @@ def issue_meter_command(payload: MeterCommandRequest, vendor=Depends(verify_vend
 # Get Meter Command Status
 # -----------------------------
 @router.get("/meter-command/{command_id}")
-def get_meter_command_status(command_id: int, vendor=Depends(verify_vendor_api_key)):
-    command = db.get_meter_command(command_id)
+async def get_meter_command_status(command_id: int, vendor=Depends(verify_vendor_api_key)):
+    command = await db.get_meter_command(command_id)
     if not command:
         raise HTTPException(status_code=404, detail="Command not found")
     return {
@@ -96,20 +157,24 @@ def get_meter_command_status(command_id: int, vendor=Depends(verify_vendor_api_k
 # Process Recharge Endpoint
 # -----------------------------
 @router.post("/process-recharge")
-def process_recharge(payload: RechargeRequest, vendor=Depends(verify_vendor_api_key)):
-    consumer = db.get_consumer_by_id(payload.consumer_id)
-    if not consumer:
+async def process_recharge(payload: RechargeRequest, vendor=Depends(verify_vendor_api_key)):
+    # Ledger insert and in-place balance increment commit together; a repeated transaction_ref is replayed
+    try:
+        result = await db.process_recharge(payload.consumer_id, payload.amount, payload.payment_mode,
+                                           payload.transaction_ref)
+    except RechargeConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if result is None:
         raise HTTPException(status_code=404, detail="Consumer not found")
-    db.add_recharge(payload.consumer_id, payload.amount, payload.payment_mode, payload.transaction_ref)
-    db.update_consumer_balance(payload.consumer_id, consumer.balance + payload.amount)
-    return {"status": "success", "new_balance": consumer.balance + payload.amount}
+    return {"status": "success", "new_balance": result.balance, "replayed": result.replayed}
 
 # -----------------------------
 # Daily Billing Job
 # -----------------------------
 @router.post("/daily-billing-job")
-def run_daily_billing(payload: DailyBillingRequest, vendor=Depends(verify_vendor_api_key)):
-    total, success, failed = db.run_daily_billing(payload.billing_date)
+async def run_daily_billing(payload: DailyBillingRequest, vendor=Depends(verify_vendor_api_key)):
+    # CPU- and DB-heavy batch job: run it on the threadpool so the event loop keeps serving
+    total, success, failed = await run_in_threadpool(BillingEngine().run_daily_billing, payload.billing_date)
     return {
         "status": "completed",
         "billing_date": str(payload.billing_date),
@@ -122,26 +187,38 @@ def run_daily_billing(payload: DailyBillingRequest, vendor=Depends(verify_vendor
 # Monthly Invoice Generation
 # -----------------------------
 @router.post("/generate-invoice")
-def generate_invoice(month: str, vendor=Depends(verify_vendor_api_key)):
-    invoices = db.generate_monthly_invoices(month)
-    return {"status": "success", "total_invoices": len(invoices)}
+async def generate_invoice(month: str, vendor=Depends(verify_vendor_api_key)):
+    written = await db.generate_monthly_invoices(month)
+    return {"status": "success", "total_invoices": written}
 
 # -----------------------------
 # Alerts
 # -----------------------------
 @router.get("/alerts")
-def get_alerts(vendor=Depends(verify_vendor_api_key)):
-    alerts = db.get_low_balance_alerts()
+async def get_alerts(vendor=Depends(verify_vendor_api_key)):
+    alerts = await db.get_low_balance_alerts()
     return {"alerts": alerts}
 
 # -----------------------------
 # System Status
 # -----------------------------
 @router.get("/status")
-def system_status():
+async def system_status(vendor=Depends(verify_vendor_api_key)):
+    # Query metrics and pool state reveal the schema and index layout: vendors only
     return {
         "uptime": "Operational",
-        "vendors_synced": db.get_active_vendors_count(),
-        "last_daily_billing": db.get_last_daily_billing_date()
+        "vendors_synced": await db.get_active_vendors_count(),
+        "last_daily_billing": await db.get_last_daily_billing_date(),
+        "tariff_cache": TARIFF_CACHE.stats(),
+        "vendor_key_cache": VENDOR_KEY_CACHE.stats(),
+        "db_pool": pool_stats(),
+        "db_async_pool": async_pool_stats(),
+        "db_queries": QUERY_METRICS.snapshot(),
+        "reading_ingest": READING_BUFFER.stats()
     }
 
+@router.get("/status/queries")
+async def query_status(limit: int = 20, vendor=Depends(verify_vendor_api_key)):
+    """Statements with the most total DB time: counts, rows, latency histograms, callers."""
+    return {"queries": QUERY_METRICS.top(limit)}
+